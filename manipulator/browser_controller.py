@@ -3,10 +3,19 @@ import subprocess
 import time
 import asyncio
 import config
+from AppKit import NSRunningApplication
 from screen_manager import ScreenManager
 
 logger = logging.getLogger(__name__)
 
+# Bundle ID браузеров - проверка "запущен ли" идет через LaunchServices в процессе,
+# без запуска osascript
+BROWSER_BUNDLE_IDS = {
+    "Yandex": "ru.yandex.desktop.yandex-browser",
+    "Safari": "com.apple.Safari",
+    "Google Chrome": "com.google.Chrome",
+}
+
 class BrowserController:
     """
     Управление браузером (открытие на первом мониторе, второй монитор отключен)
@@ -31,6 +40,11 @@ class BrowserController:
     
     def _is_browser_running(self) -> bool:
         """Проверяет, запущен ли браузер"""
+        bundle_id = BROWSER_BUNDLE_IDS.get(self.browser_app_name)
+        if bundle_id:
+            return len(NSRunningApplication.runningApplicationsWithBundleIdentifier_(bundle_id)) > 0
+        
+        # Неизвестный bundle ID - спрашиваем System Events
         check_script = f'''
         tell application "System Events"
             set isRunning to exists (process "{self.browser_app_name}")
@@ -40,6 +54,31 @@ class BrowserController:
         result = subprocess.run(['osascript', '-e', check_script], capture_output=True, text=True)
         return 'true' in (result.stdout or '').lower()
     
+    async def _wait_until_launched(self, timeout: float = 5.0) -> bool:
+        """
+        Ждет, пока браузер закончит запуск (вместо фиксированной паузы)
+        
+        Опрос с растущим интервалом 0.05 -> 0.5с: быстрый запуск замечаем почти сразу,
+        медленный не забивает цикл частыми проверками
+        """
+        bundle_id = BROWSER_BUNDLE_IDS.get(self.browser_app_name)
+        if not bundle_id:
+            await asyncio.sleep(2)
+            return True
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.05
+        while True:
+            # Каждый раз свежий экземпляр - свойства старого обновляются только в run loop Cocoa
+            apps = NSRunningApplication.runningApplicationsWithBundleIdentifier_(bundle_id)
+            if any(app.isFinishedLaunching() for app in apps):
+                return True
+            if loop.time() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+    
     async def open_on_secondary_monitor(self):
         """
         Открывает браузер на первом мониторе (второй монитор отключен)
@@ -54,8 +93,9 @@ class BrowserController:
             # 1) Запускаем при необходимости
             if not self._is_browser_running():
                 logger.info(f"Запускаю {self.browser_app_name}...")
-                subprocess.run(['open', '-a', self.browser_app_name])
-                await asyncio.sleep(2)
+                await asyncio.to_thread(subprocess.run, ['open', '-a', self.browser_app_name])
+                if not await self._wait_until_launched():
+                    logger.warning(f"⚠️ {self.browser_app_name} долго запускается, продолжаю")
             else:
                 logger.info(f"{self.browser_app_name} уже запущен")
 
@@ -81,13 +121,16 @@ class BrowserController:
             tell application "System Events"
                 tell application process "{self.browser_app_name}"
                     try
-                        set position of front window to {{{window_x}, {window_y}}}
-                        set size of front window to {{{window_width}, {window_height}}}
+                        -- front window разрешаем один раз для обоих свойств
+                        tell front window
+                            set position to {{{window_x}, {window_y}}}
+                            set size to {{{window_width}, {window_height}}}
+                        end tell
                     end try
                 end tell
             end tell
             '''
-            subprocess.run(['osascript', '-e', apple_script], check=False, timeout=5)
+            await asyncio.to_thread(subprocess.run, ['osascript', '-e', apple_script], check=False, timeout=5)
             await asyncio.sleep(0.5)
 
             # ЗАКОММЕНТИРОВАНО: логика второго монитора
@@ -106,31 +149,40 @@ class BrowserController:
         """Переходит по URL в активном окне браузера"""
         logger.info(f"🔗 Навигация: {url}")
 
+        # URL передаем через argv, а не подставляем в исходник: текст скрипта не зависит
+        # от адреса, и кавычки/обратные слэши в URL не ломают AppleScript
         if self.browser == "Yandex":
             apple_script = f'''
-            tell application "{self.browser_app_name}"
-                activate
-                try
-                    tell front window to set URL of active tab to "{url}"
-                on error
-                    make new document with properties {{URL:"{url}"}}
-                end try
-            end tell
+            on run argv
+                set targetURL to item 1 of argv
+                tell application "{self.browser_app_name}"
+                    activate
+                    try
+                        tell front window to set URL of active tab to targetURL
+                    on error
+                        make new document with properties {{URL:targetURL}}
+                    end try
+                end tell
+            end run
             '''
         else:
             apple_script = f'''
-            tell application "{self.browser_app_name}"
-                activate
-                try
-                    set URL of document 1 to "{url}"
-                on error
-                    make new document with properties {{URL:"{url}"}}
-                end try
-            end tell
+            on run argv
+                set targetURL to item 1 of argv
+                tell application "{self.browser_app_name}"
+                    activate
+                    try
+                        set URL of document 1 to targetURL
+                    on error
+                        make new document with properties {{URL:targetURL}}
+                    end try
+                end tell
+            end run
             '''
 
         try:
-            subprocess.run(['osascript', '-e', apple_script], check=False, timeout=5)
+            await asyncio.to_thread(subprocess.run, ['osascript', '-e', apple_script, '--', url],
+                                    check=False, timeout=5)
             logger.info(f"✅ Переход на {url}")
         except Exception as e:
             logger.error(f"Ошибка навигации: {e}")
@@ -0,0 +1,50 @@
+"""
+Загрузка system_capabilities.yaml
+
+YAML парсится один раз на процесс, а распарсенный результат кэшируется
+в pickle рядом с YAML - при следующих запусках PyYAML не нужен,
+пока YAML не изменился (сравнение по mtime)
+"""
+import logging
+import os
+import pickle
+from functools import lru_cache
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+CAPABILITIES_PATH = 'system_capabilities.yaml'
+CAPABILITIES_CACHE_PATH = 'system_capabilities.pkl'
+
+# libyaml (C) если собран, иначе чистый Python
+_YamlLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+
+@lru_cache(maxsize=1)
+def load_capabilities() -> dict:
+    """
+    Возвращает распарсенный system_capabilities.yaml (один объект на процесс)
+
+    Не изменяйте результат - он общий для всех модулей
+    """
+    yaml_mtime = os.path.getmtime(CAPABILITIES_PATH)
+
+    # Пробуем кэш, если он не старше YAML
+    try:
+        if os.path.getmtime(CAPABILITIES_CACHE_PATH) >= yaml_mtime:
+            with open(CAPABILITIES_CACHE_PATH, 'rb') as f:
+                return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        pass
+
+    with open(CAPABILITIES_PATH, 'r', encoding='utf-8') as f:
+        capabilities = yaml.load(f, Loader=_YamlLoader)
+
+    try:
+        with open(CAPABILITIES_CACHE_PATH, 'wb') as f:
+            pickle.dump(capabilities, f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logger.debug(f"Не удалось сохранить кэш capabilities: {e}")
+
+    return capabilities
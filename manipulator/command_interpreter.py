@@ -1,6 +1,7 @@
 import logging
 import google.generativeai as genai
 import config
+from response_cache import LRUCache, prompt_key
 
 logger = logging.getLogger(__name__)
 
@@ -14,11 +15,19 @@ class CommandInterpreter:
         genai.configure(api_key=config.GEMINI_API_KEY)
         # ВАЖНО: ТОЛЬКО модели 2.5+ (быстрее и качественнее 2.0)
         self.model = genai.GenerativeModel('gemini-2.5-flash')
+        # Повторные команды отвечаем из кэша без запроса к Gemini
+        self._plan_cache = LRUCache(maxsize=128)
     
     async def understand_command(self, user_text: str) -> str:
         """
         Анализирует команду пользователя и возвращает структурированный план действий
         """
+        cache_key = prompt_key(user_text)
+        cached_plan = self._plan_cache.get(cache_key)
+        if cached_plan is not None:
+            logger.info(f"♻️ План из кэша: {cached_plan}")
+            return cached_plan
+        
         prompt = f"""Ты - помощник, который анализирует команды пользователя для управления компьютером.
 
 Пользователь сказал: "{user_text}"
@@ -36,18 +45,27 @@ class CommandInterpreter:
             response = self.model.generate_content(prompt)
             plan = response.text.strip()
             logger.info(f"Gemini план: {plan}")
+            self._plan_cache.put(cache_key, plan)
             return plan
         except Exception as e:
             logger.error(f"Ошибка Gemini: {e}")
             raise
     
-    async def voice_to_text(self, audio_path: str) -> str:
+    async def voice_to_text(self, audio: bytes | str, mime_type: str = 'audio/ogg') -> str:
         """
         Конвертирует аудио в текст через Gemini
+        
+        Args:
+            audio: Байты аудио (голосовые Telegram маленькие - уходят inline, без Files API)
+                   или путь к файлу
+            mime_type: MIME тип для байтов
         """
         try:
-            # Загружаем аудио файл
-            audio_file = genai.upload_file(audio_path)
+            if isinstance(audio, (bytes, bytearray)):
+                audio_file = {'mime_type': mime_type, 'data': bytes(audio)}
+            else:
+                # Загружаем аудио файл
+                audio_file = genai.upload_file(audio)
             
             prompt = "Преобразуй это голосовое сообщение в текст. Верни ТОЛЬКО текст без дополнительных комментариев."
             
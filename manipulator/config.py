@@ -16,6 +16,9 @@ SECONDARY_MONITOR_INDEX = int(os.getenv('SECONDARY_MONITOR_INDEX', '1'))
 DEFAULT_BROWSER = os.getenv('DEFAULT_BROWSER', 'Yandex')  # Yandex, Safari, Chrome
 WAIT_FOR_USER_IDLE = os.getenv('WAIT_FOR_USER_IDLE', 'True').lower() in ('true', '1', 'yes')
 
+# Logging
+DETAILED_LOGGING = os.getenv('DETAILED_LOGGING', 'True').lower() in ('true', '1', 'yes')  # Промпты/ответы Vision в DEBUG лог
+
 # Paths
 TEMP_DIR = 'temp'
 SCREENSHOTS_DIR = 'screenshots'
@@ -0,0 +1,67 @@
+"""
+Загрузка файлов в Gemini Files API с кэшем по содержимому
+
+Один и тот же скриншот часто уходит и в verify_task_completion, и в replan
+(а при повторных replan на неизменном экране - еще раз). Ключ - SHA-256
+байтов файла, так что повторная загрузка идентичного файла не делается,
+пока загруженная копия не истекла (Files API хранит файлы 48 часов).
+Одновременные вызовы для одного файла (проверка и replan параллельно)
+ждут одну загрузку, а не грузят файл дважды
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+
+import google.generativeai as genai
+
+logger = logging.getLogger(__name__)
+
+# Files API удаляет файлы через 48ч - берем с запасом
+UPLOAD_TTL = 47 * 3600
+
+_uploaded: dict = {}  # sha256 digest -> (file, expiry)
+_in_flight: dict = {}  # sha256 digest -> Future идущей загрузки
+_lock = threading.Lock()
+
+
+def upload_file_cached(path: str):
+    """
+    genai.upload_file с кэшем по SHA-256 содержимого
+
+    Блокирующая функция - из async кода вызывать через asyncio.to_thread
+    """
+    with open(path, 'rb') as f:
+        digest = hashlib.sha256(f.read()).digest()
+
+    now = time.monotonic()
+    with _lock:
+        cached = _uploaded.get(digest)
+        if cached and cached[1] > now:
+            logger.debug(f"♻️ Файл уже загружен в Gemini: {path}")
+            return cached[0]
+        pending = _in_flight.get(digest)
+        if pending is None:
+            _in_flight[digest] = upload = Future()
+
+    if pending is not None:
+        # Этот же файл прямо сейчас грузит другой поток - ждем его результат
+        logger.debug(f"♻️ Файл уже загружается в Gemini: {path}")
+        return pending.result()
+
+    try:
+        file = genai.upload_file(path)
+    except BaseException as e:
+        with _lock:
+            del _in_flight[digest]
+        upload.set_exception(e)
+        raise
+    with _lock:
+        # Заодно выкидываем истекшие записи
+        for key in [k for k, (_, expiry) in _uploaded.items() if expiry <= now]:
+            del _uploaded[key]
+        _uploaded[digest] = (file, now + UPLOAD_TTL)
+        del _in_flight[digest]
+    upload.set_result(file)
+    return file
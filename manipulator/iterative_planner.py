@@ -9,22 +9,33 @@
 """
 import asyncio
 import logging
-import yaml
+import copy
 import json
 import os
 import time
 from typing import List, Dict, Any
 import google.generativeai as genai
 from screen_manager import ScreenManager
-import subprocess
+from capabilities import load_capabilities
+from gemini_files import upload_file_cached
+from response_cache import LRUCache, prompt_key
 import pyautogui
 from chrome_mcp_integration import get_chrome_mcp_integration, close_chrome_mcp_integration
 
 logger = logging.getLogger(__name__)
 
 # Загружаем конфиг возможностей
-with open('system_capabilities.yaml', 'r', encoding='utf-8') as f:
-    CAPABILITIES = yaml.safe_load(f)
+CAPABILITIES = load_capabilities()
+
+# Ввод текста: сам текст передается аргументом (osascript -e KEYSTROKE_SCRIPT -- текст),
+# поэтому исходник скрипта один на все вызовы
+KEYSTROKE_SCRIPT = '''
+on run argv
+    tell application "System Events"
+        keystroke (item 1 of argv)
+    end tell
+end run
+'''
 
 
 class ActionTracker:
@@ -146,6 +157,20 @@ def validate_element_description(description: str) -> tuple:
     return True, "OK"
 
 
+async def _communicate(proc: asyncio.subprocess.Process, timeout: float) -> tuple:
+    """
+    proc.communicate() с таймаутом, не блокируя event loop
+    
+    При таймауте процесс убивается (как subprocess.run(timeout=...))
+    """
+    try:
+        return await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        raise TimeoutError(f"Процесс не завершился за {timeout}с")
+
+
 class IterativePlanner:
     """
     Планировщик с динамической корректировкой плана
@@ -167,6 +192,19 @@ class IterativePlanner:
         self.max_replans = CAPABILITIES['limits']['max_replans']
         self.chrome_mcp = None  # Lazy init при необходимости
         self.is_browser_task = False  # Флаг для определения типа задачи
+        # Начальный план зависит только от текста запроса (без скриншота) - кэшируем
+        self._initial_plan_cache = LRUCache(maxsize=64)
+        self._click_executor = None  # SelfCorrectingExecutor, создается при первом CLICK
+    
+    def reset_task_state(self):
+        """
+        Сбрасывает состояние текущей задачи (прогресс, неудачные действия, счетчик replan)
+        
+        Кэш начальных планов и executor остаются - планировщик можно использовать для следующей задачи
+        """
+        self.tracker = ProgressTracker(stuck_threshold=CAPABILITIES['limits']['stuck_threshold'])
+        self.action_tracker = ActionTracker()
+        self.replan_count = 0
         
     async def _ensure_app_is_active(self, params: Dict):
         """
@@ -326,6 +364,12 @@ Spotify задача:
                 'reasoning': str
             }
         """
+        cache_key = prompt_key(user_request)
+        cached_plan = self._initial_plan_cache.get(cache_key)
+        if cached_plan is not None:
+            logger.info(f"♻️ Начальный план из кэша: {len(cached_plan['steps'])} шагов")
+            return copy.deepcopy(cached_plan)
+        
         capabilities = self._build_capabilities_prompt()
         
         prompt = f"""{capabilities}
@@ -365,7 +409,8 @@ Spotify задача:
 НЕ планируй дальше если не видишь экран!
 """
         
-        response = self.model.generate_content(prompt)
+        # Синхронный вызов SDK - в отдельном потоке, чтобы event loop (открытие браузера и т.п.) не стоял
+        response = await asyncio.to_thread(self.model.generate_content, prompt)
         plan_text = response.text.strip()
         
         # Извлекаем JSON
@@ -385,6 +430,7 @@ Spotify задача:
         logger.info(f"📋 Создан план: {len(plan['steps'])} шагов")
         logger.info(f"🎯 Цель: {plan['goal']}")
         
+        self._initial_plan_cache.put(cache_key, copy.deepcopy(plan))
         return plan
 
     async def replan(self, screenshot_path: str, original_goal: str, 
@@ -409,7 +455,7 @@ Spotify задача:
         capabilities = self._build_capabilities_prompt()
         
         # Загружаем скриншот
-        img_file = genai.upload_file(screenshot_path)
+        img_file = await asyncio.to_thread(upload_file_cached, screenshot_path)
         
         steps_done_text = "\n".join([f"{i+1}. {step}" for i, step in enumerate(steps_done)])
         failed_history = self.action_tracker.get_history_text()
@@ -468,7 +514,9 @@ Gemini выбирает номер ячейки, мы кликаем в её ц
 Если застряли (повторяем ошибки 2+ раза) - верни пустой список steps.
 """
         
-        response = self.model.generate_content([prompt, img_file])
+        # В отдельном потоке: пока Gemini думает, loop может обработать параллельную проверку
+        # и отменить этот replan (результат потока тогда просто отбрасывается)
+        response = await asyncio.to_thread(self.model.generate_content, [prompt, img_file])
         plan_text = response.text.strip()
         
         # Извлекаем JSON
@@ -616,10 +664,12 @@ Gemini выбирает номер ячейки, мы кликаем в её ц
 
     async def _execute_click(self, params: Dict, monitor_info: Dict) -> Dict:
         """Выполняет клик по элементу через Vision"""
-        from self_correcting_executor import SelfCorrectingExecutor
-        
-        # Передаем наш ScreenManager в executor
-        executor = SelfCorrectingExecutor(screen_manager=self.screen)
+        # Один executor на планировщик (с нашим ScreenManager) - не пересоздаем на каждый клик,
+        # заодно переиспользуется его буфер для линеек
+        if self._click_executor is None:
+            from self_correcting_executor import SelfCorrectingExecutor
+            self._click_executor = SelfCorrectingExecutor(screen_manager=self.screen)
+        executor = self._click_executor
         
         # Извлекаем описание элемента - ТОЛЬКО из element_description
         element_desc = params.get('element_description', '').strip()
@@ -647,7 +697,7 @@ Gemini выбирает номер ячейки, мы кликаем в её ц
             }
         
         # Делаем скриншот
-        screenshot = self.screen.capture_secondary_monitor()
+        screenshot = await asyncio.to_thread(self.screen.capture_secondary_monitor)
         await asyncio.sleep(1)
         
         # Ищем элемент
@@ -657,6 +707,8 @@ Gemini выбирает номер ячейки, мы кликаем в её ц
         confidence_ok = element.get('confidence', 'низкая') in ['высокая', 'средняя']
         if element['found'] and confidence_ok:
             logger.info(f"✅ Элемент найден: {element_desc[:50]}")
+            # Бездействия ждем здесь асинхронно - синхронное ожидание в click_at встало бы на весь loop
+            await self.screen.wait_for_idle_async()
             self.screen.click_at(element['x'], element['y'], force=True)
             await asyncio.sleep(1)
             return {'success': True, 'result': f'Кликнул на {element_desc[:50]}', 'needs_replan': False}
@@ -668,14 +720,10 @@ Gemini выбирает номер ячейки, мы кликаем в её ц
     async def _execute_type(self, params: Dict) -> Dict:
         """Вводит текст"""
         text = params.get('text', '')
-        safe_text = text.replace('\\', '\\\\').replace('"', '\\"')
-        
-        script = f'''
-        tell application "System Events"
-            keystroke "{safe_text}"
-        end tell
-        '''
-        subprocess.run(['osascript', '-e', script], timeout=10)
+        
+        # Текст идет через argv - экранировать под AppleScript не нужно
+        proc = await asyncio.create_subprocess_exec('osascript', '-e', KEYSTROKE_SCRIPT, '--', text)
+        await _communicate(proc, timeout=10)
         await asyncio.sleep(0.5)
         
         return {'success': True, 'result': f'Ввел текст: {text}', 'needs_replan': False}
@@ -685,12 +733,14 @@ Gemini выбирает номер ячейки, мы кликаем в её ц
         command = params.get('command', '')
         cwd = params.get('cwd', os.path.expanduser('~'))
         
-        result = subprocess.run(command, shell=True, cwd=cwd, 
-                              capture_output=True, text=True, timeout=30)
+        proc = await asyncio.create_subprocess_shell(command, cwd=cwd,
+                                                     stdout=asyncio.subprocess.PIPE,
+                                                     stderr=asyncio.subprocess.PIPE)
+        stdout, stderr = await _communicate(proc, timeout=30)
         
         return {
-            'success': result.returncode == 0,
-            'result': result.stdout or result.stderr,
+            'success': proc.returncode == 0,
+            'result': stdout.decode(errors='replace') or stderr.decode(errors='replace'),
             'needs_replan': False
         }
 
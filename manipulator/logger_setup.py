@@ -46,7 +46,8 @@ def cleanup_old_screenshots():
         if not os.path.exists(screenshots_dir):
             continue
             
-        for screenshot_file in Path(screenshots_dir).glob('*.png'):
+        # PNG - для поиска элементов, JPG - capture_secondary_monitor(image_format='jpg')
+        for screenshot_file in (f for pattern in ('*.png', '*.jpg') for f in Path(screenshots_dir).glob(pattern)):
             file_time = datetime.fromtimestamp(screenshot_file.stat().st_mtime)
             if file_time < cutoff_date:
                 screenshot_file.unlink()
@@ -0,0 +1,52 @@
+"""
+Небольшой LRU кэш для ответов Gemini
+
+Повторные команды ("открой YouTube") не должны каждый раз ждать полный
+round-trip к Gemini - ключом служит текст запроса с нормализованными пробелами.
+Регистр и пунктуацию не трогаем: в запросе бывают текст для ввода, URL и ID
+видео, где "a.b" и "a b" (или "Abc" и "abc") - разные задачи
+"""
+import hashlib
+import re
+from collections import OrderedDict
+from typing import Any, Optional
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_prompt(text: str) -> str:
+    """Нормализует текст запроса: только обрезка и схлопывание пробелов (регистр и пунктуация сохраняются)"""
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def prompt_key(text: str) -> str:
+    """SHA-256 от нормализованного текста (ключ для кэша)"""
+    return hashlib.sha256(normalize_prompt(text).encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    """Кэш фиксированного размера, вытесняет самые давние записи"""
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data: OrderedDict = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Возвращает значение или None (и помечает запись как свежую)"""
+        if key not in self._data:
+            return None
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def put(self, key: str, value: Any):
+        """Сохраняет значение, при переполнении удаляет самую старую запись"""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
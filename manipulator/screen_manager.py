@@ -1,3 +1,4 @@
+import hashlib
 import logging
 import pyautogui
 from Quartz import CGDisplayBounds, CGMainDisplayID, CGGetActiveDisplayList
@@ -14,6 +15,13 @@ warnings.filterwarnings('ignore', message='.*ALTS.*')
 
 logger = logging.getLogger(__name__)
 
+
+def screenshot_digest(filepath: str) -> bytes:
+    """SHA-256 байтов файла скриншота - совпадает только у попиксельно одинаковых экранов"""
+    with open(filepath, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
 class ScreenManager:
     """
     Управление мониторами, скриншотами и кликами
@@ -73,19 +81,24 @@ class ScreenManager:
         logger.info("🖥️ Использую первый монитор (второй монитор отключен)")
         return self.displays[0]
     
-    def capture_secondary_monitor(self) -> str:
+    def capture_secondary_monitor(self, image_format: str = 'png') -> str:
         """
         Делает скриншот первого монитора (второй монитор отключен)
         
         ВАЖНО: screencapture возвращает ФИЗИЧЕСКОЕ разрешение (Retina 2x)
         Логика из color_pipette.py - НЕ ресайзим, работаем с оригиналом
         
+        Args:
+            image_format: 'png' (по умолчанию, без потерь - для поиска элементов)
+                          или 'jpg' (в разы быстрее кодируется и легче - для
+                          отладочных скриншотов и проверок, где пиксели не важны)
+        
         Returns:
             Путь к файлу скриншота
         """
         display = self.get_secondary_monitor()  # Возвращает первый монитор
         timestamp = int(time.time())
-        filename = f"screenshot_{timestamp}.png"
+        filename = f"screenshot_{timestamp}.{image_format}"
         filepath = os.path.join(config.SCREENSHOTS_DIR, filename)
         
         # Делаем скриншот ТОЛЬКО второго монитора
@@ -95,6 +108,7 @@ class ScreenManager:
         subprocess.run([
             'screencapture',
             '-x',  # Без звука
+            '-t', image_format,
             '-R', region,  # Регион второго монитора
             filepath
         ], check=True, stderr=subprocess.DEVNULL)  # Игнорируем stderr warnings
@@ -116,6 +130,19 @@ class ScreenManager:
         display = self.get_secondary_monitor()  # Возвращает первый монитор
         return display
     
+    async def wait_for_idle_async(self) -> bool:
+        """
+        Ждёт бездействия пользователя, не блокируя event loop (если ожидание включено)
+        
+        Для async кода: подождать здесь, а потом вызвать click_at(..., force=True)
+        """
+        if not (self.wait_for_user_idle and self.activity_detector):
+            return True
+        if not await self.activity_detector.wait_for_idle_async(idle_seconds=2.2, show_notification=True):
+            logger.warning("⚠️ Не дождались бездействия, но продолжаю...")
+            return False
+        return True
+    
     def click_at(self, x: int, y: int, force: bool = False):
         """
         Кликает по координатам на первом мониторе (второй монитор отключен)
@@ -10,12 +10,15 @@
 Работает с ЛЮБЫМ приложением и задачей
 """
 import asyncio
+import io
 import logging
 import os
 import warnings
 import google.generativeai as genai
-from PIL import Image
+import numpy as np
+from PIL import Image, ImageFont
 import config
+from gemini_files import upload_file_cached
 from screen_manager import ScreenManager
 
 # Игнорируем ALTS warnings от Google API
@@ -30,21 +33,71 @@ logger = logging.getLogger(__name__)
 genai.configure(api_key=config.GEMINI_API_KEY)
 vision_model = genai.GenerativeModel('gemini-2.5-flash')
 
-# Детальное логирование для отладки
-DETAILED_LOGGING = True
+# Детальное логирование для отладки (промпты и ответы Vision на уровне DEBUG)
+DETAILED_LOGGING = config.DETAILED_LOGGING
 
 def log_vision_call(prompt: str, response: str, label: str = "Vision"):
     """Детальное логирование Vision вызовов"""
-    if DETAILED_LOGGING:
-        print(f"\n{'='*70}")
-        print(f"🔍 {label} - ЗАПРОС К GEMINI:")
-        print(f"{'='*70}")
-        print(prompt[:500] + ("..." if len(prompt) > 500 else ""))
-        print(f"\n{'='*70}")
-        print(f"📥 {label} - ОТВЕТ GEMINI:")
-        print(f"{'='*70}")
-        print(response[:500] + ("..." if len(response) > 500 else ""))
-        print(f"{'='*70}\n")
+    if not DETAILED_LOGGING or not logger.isEnabledFor(logging.DEBUG):
+        return
+    logger.debug("🔍 %s - ЗАПРОС К GEMINI:\n%s%s", label, prompt[:500], "..." if len(prompt) > 500 else "")
+    logger.debug("📥 %s - ОТВЕТ GEMINI:\n%s%s", label, response[:500], "..." if len(response) > 500 else "")
+
+
+def image_to_jpeg_part(img, quality: int = 85) -> dict:
+    """
+    Готовит одноразовое изображение (фрагмент с линейками) для inline-отправки в Gemini
+    
+    Без upload_file: не нужен лишний round-trip в Files API,
+    JPEG заметно легче PNG для увеличенных фрагментов
+    """
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=quality)
+    return {'mime_type': 'image/jpeg', 'data': buf.getvalue()}
+
+
+RULER_YELLOW = (255, 255, 0)
+RULER_CYAN = (0, 255, 255)
+# Шрифт подписей - загружаем один раз, а не в каждом ImageDraw
+RULER_FONT = ImageFont.load_default()
+
+# Ввод текста в поле и Enter: текст передается аргументом osascript,
+# исходник скрипта один на все вызовы
+TYPE_AND_SUBMIT_SCRIPT = '''
+on run argv
+    tell application "System Events"
+        keystroke (item 1 of argv)
+        delay 2
+        keystroke return
+        delay 1
+    end tell
+end run
+'''
+
+
+def _line_span(center: int, width: int) -> tuple:
+    """Пиксели толстой линии вокруг center - так же, как их закрашивает ImageDraw.line"""
+    return center - (width - 1) // 2, center + width // 2 + 1
+
+
+def _fill_line(arr: np.ndarray, center: int, width: int, color):
+    """Горизонтальная линия толщиной width во всю ширину массива (для вертикальной - передать arr.transpose(1, 0, 2))"""
+    r0, r1 = _line_span(center, width)
+    r0, r1 = max(0, r0), min(arr.shape[0], r1)
+    if r0 < r1:
+        arr[r0:r1] = color
+
+
+def _fill_ticks(arr: np.ndarray, positions: np.ndarray, center: int, half_len: int, width: int, color):
+    """
+    Все метки линейки одним присваиванием: перпендикулярные отрезки длиной 2*half_len
+    в точках positions вдоль горизонтальной линии на высоте center
+    """
+    cols = (positions[:, None] + np.arange(*_line_span(0, width))).ravel()
+    cols = cols[(cols >= 0) & (cols < arr.shape[1])]
+    r0, r1 = max(0, center - half_len), min(arr.shape[0], center + half_len + 1)
+    if r0 < r1 and cols.size:
+        arr[r0:r1, cols] = color
 
 
 class SelfCorrectingExecutor:
@@ -61,6 +114,8 @@ class SelfCorrectingExecutor:
             import config
             self.screen = ScreenManager(wait_for_user_idle=config.WAIT_FOR_USER_IDLE)
         self.max_attempts = 3
+        # Буфер увеличенного фрагмента для линеек - размер между итерациями почти всегда одинаковый
+        self._ruler_buf = None
     
     async def ensure_app_active(self, app_name: str) -> bool:
         """
@@ -74,26 +129,30 @@ class SelfCorrectingExecutor:
         """
         import subprocess
         
-        # Проверяем активное приложение
-        check_script = '''
+        # Проверка и активация одним вызовом osascript: отдельный запуск на
+        # проверку и еще один на activate стоили по процессу (~0.2с+) каждый
+        safe_name = app_name.replace('\\', '\\\\').replace('"', '\\"')
+        script = f'''
         tell application "System Events"
             set frontApp to name of first application process whose frontmost is true
-            return frontApp
         end tell
+        ignoring case
+            set isActive to frontApp contains "{safe_name}"
+        end ignoring
+        if not isActive then tell application "{safe_name}" to activate
+        return (isActive as string) & "|" & frontApp
         '''
         try:
-            result = subprocess.run(['osascript', '-e', check_script], 
-                                  capture_output=True, text=True, timeout=5)
-            active_app = result.stdout.strip()
+            result = await asyncio.to_thread(subprocess.run, ['osascript', '-e', script],
+                                            capture_output=True, text=True, timeout=5)
+            is_active, _, active_app = result.stdout.strip().partition('|')
             
-            if app_name.lower() in active_app.lower():
+            if is_active == 'true':
                 logger.debug(f"✅ {app_name} активен")
                 return True
             
-            # Если не активен - активируем
-            logger.info(f"⚠️ {app_name} не активен (активен: {active_app}). Активирую...")
-            activate_script = f'tell application "{app_name}" to activate'
-            subprocess.run(['osascript', '-e', activate_script], timeout=5)
+            # Не был активен - скрипт уже вызвал activate, даем окну подняться
+            logger.info(f"⚠️ {app_name} не был активен (активен: {active_app}). Активировал")
             await asyncio.sleep(1)
             return True
             
@@ -110,7 +169,7 @@ class SelfCorrectingExecutor:
             x, y: координаты точки
             point_radius: радиус точки на увеличенном изображении
             crop_size: размер вырезаемой области вокруг точки (по умолчанию 500px = область 1000x1000px)
-            zoom_factor: во сколько раз увеличить
+            zoom_factor: во сколько раз увеличить (целое число)
             
         Returns:
             PIL Image с точкой и линейками
@@ -123,73 +182,74 @@ class SelfCorrectingExecutor:
         crop_x2 = min(width, x + crop_size)
         crop_y2 = min(height, y + crop_size)
         
-        cropped = img.crop((crop_x1, crop_y1, crop_x2, crop_y2))
-        crop_w, crop_h = cropped.size
+        cropped = np.asarray(img.crop((crop_x1, crop_y1, crop_x2, crop_y2)).convert('RGB'))
+        crop_h, crop_w = cropped.shape[:2]
         
         # Координаты точки на вырезе (ДО увеличения)
         local_x = x - crop_x1
         local_y = y - crop_y1
         
-        # Увеличиваем
+        # Увеличиваем в целое число раз прямо в переиспользуемый буфер
+        # (каждый пиксель -> квадрат zoom x zoom, края линеек остаются резкими)
         zoomed_w = crop_w * zoom_factor
         zoomed_h = crop_h * zoom_factor
-        zoomed = cropped.resize((zoomed_w, zoomed_h), Image.Resampling.LANCZOS)
+        if self._ruler_buf is None or self._ruler_buf.shape[:2] != (zoomed_h, zoomed_w):
+            self._ruler_buf = np.empty((zoomed_h, zoomed_w, 3), dtype=np.uint8)
+        buf = self._ruler_buf
+        buf.reshape(crop_h, zoom_factor, crop_w, zoom_factor, 3)[:] = cropped[:, None, :, None, :]
         
         # Координаты на увеличенном изображении
         zoomed_x = local_x * zoom_factor
         zoomed_y = local_y * zoom_factor
         
-        draw = ImageDraw.Draw(zoomed)
-        
-        # Красная точка
-        draw.ellipse([zoomed_x - point_radius, zoomed_y - point_radius,
-                     zoomed_x + point_radius, zoomed_y + point_radius],
-                    fill='red', outline='white', width=4)
+        # Линии и метки линеек пишем прямо в буфер (срезы NumPy вместо сотни draw.line)
+        offsets = np.arange(-crop_size, crop_size + 1, 10)
+        is_long = offsets % 50 == 0  # Длинные метки с подписью
         
         # ЖЕЛТАЯ горизонтальная линейка
         ruler_h_offset = 50
         ruler_h_y = zoomed_y + ruler_h_offset
-        draw.line([(0, ruler_h_y), (zoomed_w, ruler_h_y)], fill='yellow', width=4)
-        
-        # Метки для горизонтальной линейки
-        for real_offset in range(-crop_size, crop_size + 1, 10):
-            tick_x = zoomed_x + (real_offset * zoom_factor)
-            if tick_x < 0 or tick_x > zoomed_w:
-                continue
-            tick_y = ruler_h_y
-            
-            if real_offset % 50 == 0:  # Длинная метка с подписью
-                draw.line([(tick_x, tick_y - 20), (tick_x, tick_y + 20)], fill='yellow', width=4)
-                label = f"{real_offset:+d}" if real_offset != 0 else "0"
-                text_y = tick_y + 30 if tick_y < zoomed_h / 2 else tick_y - 45
-                draw.text((tick_x - 25, text_y), label, fill='yellow')
-            else:  # Короткая метка
-                draw.line([(tick_x, tick_y - 10), (tick_x, tick_y + 10)], fill='yellow', width=3)
+        ticks_x = zoomed_x + offsets * zoom_factor
+        in_bounds = (ticks_x >= 0) & (ticks_x <= zoomed_w)
+        long_x = in_bounds & is_long
+        _fill_line(buf, ruler_h_y, 4, RULER_YELLOW)
+        _fill_ticks(buf, ticks_x[in_bounds & ~is_long], ruler_h_y, 10, 3, RULER_YELLOW)
+        _fill_ticks(buf, ticks_x[long_x], ruler_h_y, 20, 4, RULER_YELLOW)
         
-        # ГОЛУБАЯ вертикальная линейка
+        # ГОЛУБАЯ вертикальная линейка (та же горизонтальная на транспонированном виде)
         ruler_v_offset = 50
         ruler_v_x = zoomed_x + ruler_v_offset
-        draw.line([(ruler_v_x, 0), (ruler_v_x, zoomed_h)], fill='cyan', width=4)
+        ticks_y = zoomed_y + offsets * zoom_factor
+        in_bounds = (ticks_y >= 0) & (ticks_y <= zoomed_h)
+        long_y = in_bounds & is_long
+        buf_t = buf.transpose(1, 0, 2)
+        _fill_line(buf_t, ruler_v_x, 4, RULER_CYAN)
+        _fill_ticks(buf_t, ticks_y[in_bounds & ~is_long], ruler_v_x, 10, 3, RULER_CYAN)
+        _fill_ticks(buf_t, ticks_y[long_y], ruler_v_x, 20, 4, RULER_CYAN)
+        
+        zoomed = Image.fromarray(buf)
+        draw = ImageDraw.Draw(zoomed)
+        
+        # Красная точка
+        draw.ellipse([zoomed_x - point_radius, zoomed_y - point_radius,
+                     zoomed_x + point_radius, zoomed_y + point_radius],
+                    fill='red', outline='white', width=4)
         
-        # Метки для вертикальной линейки
-        for real_offset in range(-crop_size, crop_size + 1, 10):
-            tick_y = zoomed_y + (real_offset * zoom_factor)
-            if tick_y < 0 or tick_y > zoomed_h:
-                continue
-            tick_x = ruler_v_x
-            
-            if real_offset % 50 == 0:  # Длинная метка с подписью
-                draw.line([(tick_x - 20, tick_y), (tick_x + 20, tick_y)], fill='cyan', width=4)
-                label = f"{real_offset:+d}" if real_offset != 0 else "0"
-                text_x = tick_x + 30 if tick_x < zoomed_w / 2 else tick_x - 70
-                draw.text((text_x, tick_y - 12), label, fill='cyan')
-            else:  # Короткая метка
-                draw.line([(tick_x - 10, tick_y), (tick_x + 10, tick_y)], fill='cyan', width=3)
+        # Подписи длинных меток
+        text_y = ruler_h_y + 30 if ruler_h_y < zoomed_h / 2 else ruler_h_y - 45
+        for real_offset, tick_x in zip(offsets[long_x].tolist(), ticks_x[long_x].tolist()):
+            label = f"{real_offset:+d}" if real_offset != 0 else "0"
+            draw.text((tick_x - 25, text_y), label, fill='yellow', font=RULER_FONT)
+        
+        text_x = ruler_v_x + 30 if ruler_v_x < zoomed_w / 2 else ruler_v_x - 70
+        for real_offset, tick_y in zip(offsets[long_y].tolist(), ticks_y[long_y].tolist()):
+            label = f"{real_offset:+d}" if real_offset != 0 else "0"
+            draw.text((text_x, tick_y - 12), label, fill='cyan', font=RULER_FONT)
         
         # Инфо в углу
-        draw.text((10, 10), f"Координаты: ({x}, {y})", fill='white')
-        draw.text((10, 35), f"Увеличение: x{zoom_factor}", fill='white')
-        draw.text((10, 60), f"Линейки: реальные пиксели", fill='white')
+        draw.text((10, 10), f"Координаты: ({x}, {y})", fill='white', font=RULER_FONT)
+        draw.text((10, 35), f"Увеличение: x{zoom_factor}", fill='white', font=RULER_FONT)
+        draw.text((10, 60), f"Линейки: реальные пиксели", fill='white', font=RULER_FONT)
         
         return zoomed
     
@@ -201,7 +261,7 @@ class SelfCorrectingExecutor:
             Название приложения (YouTube, Spotify, Safari, etc)
         """
         try:
-            img_file = genai.upload_file(screenshot_path)
+            img_file = await asyncio.to_thread(upload_file_cached, screenshot_path)
             
             prompt = """Определи какое ПРИЛОЖЕНИЕ или САЙТ сейчас активен на этом скриншоте.
 
@@ -216,7 +276,7 @@ class SelfCorrectingExecutor:
 
 Ответь только названием, без объяснений."""
 
-            response = vision_model.generate_content([prompt, img_file])
+            response = await asyncio.to_thread(vision_model.generate_content, [prompt, img_file])
             app_name = response.text.strip()
             
             log_vision_call(prompt, app_name, "identify_app")
@@ -246,7 +306,7 @@ class SelfCorrectingExecutor:
             logger.info(f"🔍 Проверка выполнения через Gemini Vision: {task_description}")
             
             # Загружаем скриншот
-            img_file = genai.upload_file(screenshot_path)
+            img_file = await asyncio.to_thread(upload_file_cached, screenshot_path)
             
             prompt = f"""Проанализируй этот скриншот и ответь на вопрос:
 
@@ -274,7 +334,7 @@ class SelfCorrectingExecutor:
 
 Будь строг: completed=true только если задача ТОЧНО выполнена."""
 
-            response = vision_model.generate_content([prompt, img_file])
+            response = await asyncio.to_thread(vision_model.generate_content, [prompt, img_file])
             result_text = response.text.strip()
             
             # Логируем вызов
@@ -352,6 +412,12 @@ class SelfCorrectingExecutor:
             width, height = original.size
             logger.info(f"📐 Размер скриншота: {width}x{height}")
             
+            # В Gemini отправляем файл как его записал screencapture - PIL картинку после
+            # convert() SDK заново кодировал бы в lossless WebP (долго на Retina)
+            mime_type = 'image/jpeg' if screenshot_path.endswith('.jpg') else 'image/png'
+            with open(screenshot_path, 'rb') as f:
+                screenshot_part = {'mime_type': mime_type, 'data': f.read()}
+            
             # ШАГ 1: Запрос начальных координат
             logger.info(f"📍 Запрашиваю начальные координаты для: {element_description}")
             
@@ -370,7 +436,7 @@ class SelfCorrectingExecutor:
 Координаты: 520 1650
 Описание: кнопка поиска в верхней панели'''
             
-            response = vision_model.generate_content([initial_prompt, original])
+            response = await asyncio.to_thread(vision_model.generate_content, [initial_prompt, screenshot_part])
             answer = response.text.strip()
             logger.debug(f"📥 Ответ Gemini: {answer[:200]}...")
             
@@ -393,16 +459,24 @@ class SelfCorrectingExecutor:
             # ШАГ 2: Итеративное уточнение с линейками (макс 5 итераций)
             # Вырезается область 1000x1000px (500px в каждую сторону), увеличивается в 3 раза
             max_iterations = 5
+            point_img = None
+            point_img_coords = None
             for iteration in range(1, max_iterations + 1):
                 logger.info(f"🔄 Итерация {iteration}/{max_iterations}: проверка координат ({current_x}, {current_y})")
                 
                 # Рисуем точку + линейки (область 1000x1000px вокруг точки)
-                point_img = self._draw_point_with_rulers(original, current_x, current_y)
-                
-                # Сохраняем для проверки
-                import time
-                iter_path = f'screenshots/ruler_iter{iteration}_{int(time.time())}.png'
-                point_img.save(iter_path)
+                # только если точка сдвинулась - иначе переиспользуем прошлую картинку
+                if point_img_coords != (current_x, current_y):
+                    point_img = self._draw_point_with_rulers(original, current_x, current_y)
+                    point_img_coords = (current_x, current_y)
+                    
+                    # Сохраняем для проверки (кодирование PNG 3000x3000 - только при детальном логировании)
+                    if DETAILED_LOGGING:
+                        import time
+                        iter_path = f'screenshots/ruler_iter{iteration}_{int(time.time())}.png'
+                        point_img.save(iter_path)
+                else:
+                    logger.debug("♻️ Координаты не изменились, использую прошлое изображение с линейками")
                 
                 # Проверяем точность
                 verify_prompt = f'''На изображении показан УВЕЛИЧЕННЫЙ ФРАГМЕНТ экрана.
@@ -444,7 +518,8 @@ class SelfCorrectingExecutor:
 - Элемент НИЖЕ → Y положительный (+)
 - Элемент ВЫШЕ → Y отрицательный (-)'''
                 
-                verify_response = vision_model.generate_content([verify_prompt, point_img])
+                verify_response = await asyncio.to_thread(vision_model.generate_content,
+                                                          [verify_prompt, image_to_jpeg_part(point_img)])
                 verify_answer = verify_response.text.strip()
                 logger.debug(f"📥 Проверка: {verify_answer[:200]}...")
                 
@@ -469,7 +544,7 @@ class SelfCorrectingExecutor:
 Координаты: 520 1650
 Описание: кнопка поиска в верхней панели'''
                     
-                    retry_response = vision_model.generate_content([retry_prompt, original])
+                    retry_response = await asyncio.to_thread(vision_model.generate_content, [retry_prompt, screenshot_part])
                     retry_answer = retry_response.text.strip()
                     logger.debug(f"📥 Повторный ответ: {retry_answer[:200]}...")
                     
@@ -558,6 +633,9 @@ class SelfCorrectingExecutor:
             
         Система сама определит какой элемент кликать если primary не сработал
         """
+        # Раскладка мониторов не меняется в рамках задачи - запрашиваем один раз
+        monitor_info = self.screen.get_secondary_monitor_info()
+        
         for attempt in range(1, self.max_attempts + 1):
             print(f"\n{'='*70}")
             print(f"🔄 Попытка {attempt}/{self.max_attempts}")
@@ -574,7 +652,7 @@ class SelfCorrectingExecutor:
             
             # 2. Делаем скриншот
             print(f"   📸 Создаю скриншот...")
-            screenshot_path = self.screen.capture_secondary_monitor()
+            screenshot_path = await asyncio.to_thread(self.screen.capture_secondary_monitor)
             
             # 3. Проверяем результат через Gemini Vision
             print(f"   🔍 Проверяю результат через Gemini Vision...")
@@ -603,7 +681,6 @@ class SelfCorrectingExecutor:
                     elif 'youtube' in task_description.lower() or 'видео' in task_description.lower():
                         await self.ensure_app_active('Yandex')
                     
-                    monitor_info = self.screen.get_secondary_monitor_info()
                     element = await self.find_element_coordinates(screenshot_path, next_element, monitor_info)
                     
                     # confidence теперь строка: 'высокая', 'средняя', 'низкая'
@@ -637,32 +714,24 @@ class SelfCorrectingExecutor:
 
 Ответь ТОЛЬКО текстом для ввода, без JSON, без объяснений."""
 
-                            response = vision_model.generate_content(prompt)
+                            response = await asyncio.to_thread(vision_model.generate_content, prompt)
                             text_to_type = response.text.strip().replace('"', '').replace("'", '')
                             
                             print(f"   ⌨️  Ввожу текст: {text_to_type}")
                             import subprocess
-                            # Экранируем спецсимволы для AppleScript
-                            safe_text = text_to_type.replace('\\', '\\\\').replace('"', '\\"')
-                            script = f'''
-                            tell application "System Events"
-                                keystroke "{safe_text}"
-                                delay 2
-                                keystroke return
-                                delay 1
-                            end tell
-                            '''
-                            subprocess.run(['osascript', '-e', script], timeout=10)
+                            # Текст идет через argv - без экранирования под AppleScript
+                            await asyncio.to_thread(subprocess.run,
+                                                    ['osascript', '-e', TYPE_AND_SUBMIT_SCRIPT, '--', text_to_type],
+                                                    timeout=10)
                             print(f"   ⏳ Жду результаты...")
                             await asyncio.sleep(3)
                             
                             # Делаем новый скриншот и ищем первый результат
                             print(f"   📸 Скриншот результатов поиска...")
-                            new_screenshot = self.screen.capture_secondary_monitor()
+                            new_screenshot = await asyncio.to_thread(self.screen.capture_secondary_monitor)
                             
                             print(f"   🔍 Ищу первый результат поиска...")
                             await asyncio.sleep(2)
-                            monitor_info = self.screen.get_secondary_monitor_info()
                             first_result = await self.find_element_coordinates(
                                 new_screenshot,
                                 "первая карточка трека в результатах поиска (не реклама, не плейлист)",
@@ -1,18 +1,43 @@
 import logging
 import asyncio
+import re
 from telegram import Update
-import yaml
 
-from screen_manager import ScreenManager
+from capabilities import load_capabilities
+from screen_manager import ScreenManager, screenshot_digest
 from browser_controller import BrowserController
 from iterative_planner import IterativePlanner
+from self_correcting_executor import SelfCorrectingExecutor
 import config
 
 logger = logging.getLogger(__name__)
 
 # Загружаем список приложений
-with open('system_capabilities.yaml', 'r', encoding='utf-8') as f:
-    CAPABILITIES = yaml.safe_load(f)
+CAPABILITIES = load_capabilities()
+
+# Ключевые слова браузерных задач (браузеры + веб-сайты/поиск)
+BROWSER_KEYWORDS = ['chrome', 'safari', 'yandex', 'firefox', 'browser', 'tor browser',
+                    'youtube', 'google', 'сайт', 'найти в интернете', 'поиск в интернете']
+_WORD_RE = re.compile(r'\w+')
+
+# Шаблоны сообщений с планом (Telegram Markdown)
+PLAN_TEMPLATE = "📋 *План создан*\n\n🎯 *Цель:* {goal}\n\n*Шаги:*\n{body}"
+NEW_PLAN_TEMPLATE = "📋 *Новый план* ({count} шагов):\n{body}"
+# Экранирование спецсимволов Markdown в тексте от Gemini (PRESS_KEY, snake_case и т.п.)
+_MARKDOWN_ESCAPE = str.maketrans({c: '\\' + c for c in '_*`['})
+
+
+def _compile_keywords(keywords) -> re.Pattern | None:
+    """
+    Собирает ключевые слова в одно регулярное выражение (длинные фразы первыми)
+    
+    Пустой список -> None: re.compile('') совпал бы с любой строкой
+    """
+    keywords = [k for k in keywords if k]
+    if not keywords:
+        return None
+    return re.compile('|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True)))
+
 
 class TaskExecutor:
     """
@@ -25,6 +50,16 @@ class TaskExecutor:
         self.browser = BrowserController(browser=config.DEFAULT_BROWSER, screen=self.screen)
         # Передаем наш ScreenManager в planner чтобы использовать одинаковые настройки
         self.planner = IterativePlanner(api_key=config.GEMINI_API_KEY, screen_manager=self.screen)
+        # Один верификатор на все проверки (replan + финальная)
+        self._verifier = SelfCorrectingExecutor(screen_manager=self.screen)
+        # Детект типа задачи: по одному проходу регулярки на категорию вместо цикла по словам
+        # Сначала пересечение слов с frozenset (точные совпадения однословных ключей),
+        # регулярка - только если не нашли (фразы, падежи: "сайте", "spotify's")
+        self._browser_re = _compile_keywords(BROWSER_KEYWORDS)
+        self._browser_tokens = frozenset(k for k in BROWSER_KEYWORDS if ' ' not in k)
+        self._apps_by_lower = {app.lower(): app for app in CAPABILITIES['applications']}
+        self._apps_re = _compile_keywords(self._apps_by_lower)
+        self._app_tokens = frozenset(k for k in self._apps_by_lower if ' ' not in k)
     
     def _detect_task_type(self, task_plan: str) -> str:
         """
@@ -34,21 +69,22 @@ class TaskExecutor:
             'browser' | 'app' | 'unknown'
         """
         task_lower = task_plan.lower()
+        tokens = set(_WORD_RE.findall(task_lower))
         
-        # Проверяем упоминание браузеров (определяем по названию)
-        browser_keywords = ['chrome', 'safari', 'yandex', 'firefox', 'browser', 'tor browser']
-        if any(browser in task_lower for browser in browser_keywords):
-            return 'browser'
-        
-        # Проверяем упоминание веб-сайтов/поиска
-        if any(word in task_lower for word in ['youtube', 'google', 'сайт', 'найти в интернете', 'поиск в интернете']):
+        # Проверяем упоминание браузеров и веб-сайтов/поиска
+        if not tokens.isdisjoint(self._browser_tokens) or (self._browser_re and self._browser_re.search(task_lower)):
             return 'browser'
         
         # Проверяем упоминание других приложений
-        for app in CAPABILITIES['applications']:
-            if app.lower() in task_lower:
-                logger.info(f"📱 Обнаружено приложение: {app}")
-                return 'app'
+        app_hits = tokens & self._app_tokens
+        if app_hits:
+            app_name = next(iter(app_hits))
+        else:
+            app_match = self._apps_re.search(task_lower) if self._apps_re else None
+            app_name = app_match.group() if app_match else None
+        if app_name:
+            logger.info(f"📱 Обнаружено приложение: {self._apps_by_lower[app_name]}")
+            return 'app'
         
         # По умолчанию - универсальный режим (без открытия браузера)
         logger.info("❓ Тип задачи не определен, использую универсальный режим")
@@ -87,116 +123,24 @@ class TaskExecutor:
         """
         logger.info("🌐 Выполняю задачу с браузером")
         
-        # 1. Открываем браузер на втором мониторе
+        # Браузер открывается (и окно успокаивается) параллельно с созданием плана:
+        # план строится по тексту запроса, экран для него не нужен.
+        # Шаги начнут выполняться только когда браузер готов
+        browser_ready = asyncio.create_task(self._open_browser(update))
+        try:
+            return await self._run_plan_loop(task_plan, update, ready=browser_ready)
+        finally:
+            # Ответ пользователю уже отправлен циклом - ошибку открытия браузера только логируем
+            try:
+                await browser_ready
+            except Exception as e:
+                logger.error(f"Ошибка открытия браузера: {e}", exc_info=True)
+    
+    async def _open_browser(self, update: Update):
+        """Открывает браузер на втором мониторе и ждет, пока окно встанет на место"""
         await update.message.reply_text("🌐 Открываю браузер...")
         await self.browser.open_on_secondary_monitor()
         await asyncio.sleep(2)
-        
-        # 2. Создаем начальный план
-        await update.message.reply_text("🤖 Планирую действия...")
-        
-        try:
-            plan = await self.planner.create_initial_plan(task_plan)
-            
-            # Форматируем план для Telegram
-            plan_text = f"📋 *План создан*\n\n🎯 *Цель:* {plan['goal']}\n\n*Шаги:*\n"
-            for i, step in enumerate(plan['steps'], 1):
-                action = step['action']
-                reasoning = step.get('reasoning', '')[:50]
-                plan_text += f"{i}. {action} - {reasoning}...\n"
-            
-            await update.message.reply_text(plan_text, parse_mode='Markdown')
-            
-            # 3. Выполняем итеративно с replan
-            steps_done = []
-            current_steps = plan['steps']
-            monitor_info = self.screen.get_secondary_monitor_info()
-            
-            while current_steps:
-                for step in current_steps:
-                    # Выполняем шаг
-                    result = await self.planner.execute_step(step, monitor_info)
-                    
-                    step_desc = f"{step['action']} {step.get('params', {})}"
-                    steps_done.append(step_desc)
-                    
-                    if result['success']:
-                        logger.info(f"✅ {result['result']}")
-                    else:
-                        logger.warning(f"⚠️ {result['result']}")
-                    
-                    # Если нужен replan
-                    if result.get('needs_replan'):
-                        await update.message.reply_text("🔄 Анализирую ситуацию...")
-                        
-                        # Делаем скриншот
-                        screenshot = self.screen.capture_secondary_monitor()
-                        await asyncio.sleep(1)
-                        
-                        # Определяем текущее состояние
-                        from self_correcting_executor import SelfCorrectingExecutor
-                        executor = SelfCorrectingExecutor()
-                        verification = await executor.verify_task_completion(screenshot, plan['goal'])
-                        
-                        current_state = verification.get('explanation', 'Состояние неизвестно')
-                        
-                        # Проверяем завершение
-                        if verification.get('completed'):
-                            await update.message.reply_text("✅ Задача выполнена!")
-                            return "Задача выполнена успешно"
-                        
-                        # Запрашиваем новый план
-                        new_plan = await self.planner.replan(
-                            screenshot_path=screenshot,
-                            original_goal=plan['goal'],
-                            current_state=current_state,
-                            steps_done=steps_done
-                        )
-                        
-                        if not new_plan.get('steps'):
-                            # Или цель достигнута, или застряли
-                            if verification.get('completed'):
-                                await update.message.reply_text("✅ Цель достигнута!")
-                                return "Задача выполнена"
-                            else:
-                                await update.message.reply_text("❌ Не удалось выполнить задачу")
-                                return "Застряли в выполнении"
-                        
-                        current_steps = new_plan['steps']
-                        
-                        # Показываем новый план
-                        new_plan_text = f"📋 *Новый план* ({len(current_steps)} шагов):\n"
-                        for i, step in enumerate(current_steps, 1):
-                            action = step['action']
-                            reasoning = step.get('reasoning', '')[:40]
-                            new_plan_text += f"{i}. {action} - {reasoning}...\n"
-                        
-                        await update.message.reply_text(new_plan_text, parse_mode='Markdown')
-                        break  # Прерываем текущий цикл и начинаем новый план
-                else:
-                    # Все шаги выполнены без replan
-                    current_steps = []
-            
-            # Финальная проверка
-            screenshot = self.screen.capture_secondary_monitor()
-            from self_correcting_executor import SelfCorrectingExecutor
-            executor = SelfCorrectingExecutor()
-            verification = await executor.verify_task_completion(screenshot, plan['goal'])
-            
-            if verification.get('completed'):
-                await update.message.reply_text("✅ Задача выполнена успешно!")
-                return "Задача выполнена"
-            else:
-                await update.message.reply_text(
-                    f"⚠️ Задача выполнена частично\n"
-                    f"Состояние: {verification.get('explanation', '')}"
-                )
-                return "Выполнено частично"
-                
-        except Exception as e:
-            logger.error(f"Ошибка выполнения: {e}", exc_info=True)
-            await update.message.reply_text(f"❌ Ошибка: {e}")
-            return f"Ошибка: {e}"
     
     async def _execute_app_task(self, task_plan: str, update: Update) -> str:
         """
@@ -205,33 +149,69 @@ class TaskExecutor:
         """
         logger.info("📱 Выполняю задачу с приложением")
         
-        # Создаем начальный план БЕЗ открытия браузера
-        await update.message.reply_text("🤖 Планирую действия...")
+        return await self._run_plan_loop(task_plan, update)
+    
+    @staticmethod
+    def _format_plan(steps: list, reasoning_limit: int) -> str:
+        """Форматирует шаги плана для Telegram: нумерованный список с экранированным Markdown"""
+        return "\n".join(
+            f"{i}. {step['action']} - {(step.get('reasoning') or '')[:reasoning_limit]}...".translate(_MARKDOWN_ESCAPE)
+            for i, step in enumerate(steps, 1)
+        )
+    
+    async def _verify_screen(self, screenshot: str, goal: str, verified_screens: dict) -> dict:
+        """verify_task_completion с переиспользованием результата для байт-в-байт того же скриншота"""
+        digest = await asyncio.to_thread(screenshot_digest, screenshot)
+        verification = verified_screens.get(digest)
+        if verification is not None:
+            logger.info(f"♻️ Экран такой же, как при прошлой проверке (sha256 {digest.hex()[:16]})")
+            return verification
+        verification = await self._verifier.verify_task_completion(screenshot, goal)
+        verified_screens[digest] = verification
+        return verification
+    
+    async def _run_plan_loop(self, task_plan: str, update: Update, ready: asyncio.Future | None = None) -> str:
+        """
+        Общий цикл для браузерных задач и задач с приложениями:
+        начальный план -> выполнение шагов -> replan -> финальная проверка
+        
+        ready: чего дождаться перед первым шагом (например, открытия браузера)
+        """
+        reply = update.message.reply_text
+        await reply("🤖 Планирую действия...")
         
         try:
             plan = await self.planner.create_initial_plan(task_plan)
+            goal = plan['goal']
             
             # Форматируем план для Telegram
-            plan_text = f"📋 *План создан*\n\n🎯 *Цель:* {plan['goal']}\n\n*Шаги:*\n"
-            for i, step in enumerate(plan['steps'], 1):
-                action = step['action']
-                reasoning = step.get('reasoning', '')[:50]
-                plan_text += f"{i}. {action} - {reasoning}...\n"
-            
-            await update.message.reply_text(plan_text, parse_mode='Markdown')
+            plan_text = PLAN_TEMPLATE.format_map({
+                'goal': goal.translate(_MARKDOWN_ESCAPE),
+                'body': self._format_plan(plan['steps'], 50),
+            })
+            await reply(plan_text, parse_mode='Markdown')
             
             # Выполняем итеративно с replan
             steps_done = []
+            add_step_done = steps_done.append
+            execute_step = self.planner.execute_step
             current_steps = plan['steps']
             monitor_info = self.screen.get_secondary_monitor_info()
+            # Скриншот снимаем каждый раз (экран мог догрузиться сам, пока шла проверка/replan),
+            # а проверку Gemini пропускаем, если скриншот байт-в-байт как уже проверенный:
+            # SHA-256 скриншота -> проверка
+            verified_screens = {}
+            
+            if ready is not None:
+                await ready
             
             while current_steps:
                 for step in current_steps:
                     # Выполняем шаг
-                    result = await self.planner.execute_step(step, monitor_info)
+                    result = await execute_step(step, monitor_info)
+                    action = step['action']
                     
-                    step_desc = f"{step['action']} {step.get('params', {})}"
-                    steps_done.append(step_desc)
+                    add_step_done(f"{action} {step.get('params') or {}}")
                     
                     if result['success']:
                         logger.info(f"✅ {result['result']}")
@@ -240,28 +220,25 @@ class TaskExecutor:
                     
                     # Если нужен replan
                     if result.get('needs_replan'):
-                        await update.message.reply_text("🔄 Анализирую ситуацию...")
+                        # Сообщение в Telegram уходит параллельно со скриншотом
+                        status_msg = asyncio.create_task(reply("🔄 Анализирую ситуацию..."))
                         
-                        # Делаем скриншот
-                        screenshot = self.screen.capture_secondary_monitor()
-                        await asyncio.sleep(1)
-                        
-                        # Определяем текущее состояние
-                        from self_correcting_executor import SelfCorrectingExecutor
-                        executor = SelfCorrectingExecutor()
-                        verification = await executor.verify_task_completion(screenshot, plan['goal'])
+                        # Делаем скриншот (screencapture синхронный - файл готов сразу, ждать не нужно)
+                        screenshot = await asyncio.to_thread(self.screen.capture_secondary_monitor)
+                        verification = await self._verify_screen(screenshot, goal, verified_screens)
+                        await status_msg
                         
                         current_state = verification.get('explanation', 'Состояние неизвестно')
                         
                         # Проверяем завершение
                         if verification.get('completed'):
-                            await update.message.reply_text("✅ Задача выполнена!")
+                            await reply("✅ Задача выполнена!")
                             return "Задача выполнена успешно"
                         
                         # Запрашиваем новый план
                         new_plan = await self.planner.replan(
                             screenshot_path=screenshot,
-                            original_goal=plan['goal'],
+                            original_goal=goal,
                             current_state=current_state,
                             steps_done=steps_done
                         )
@@ -269,38 +246,34 @@ class TaskExecutor:
                         if not new_plan.get('steps'):
                             # Или цель достигнута, или застряли
                             if verification.get('completed'):
-                                await update.message.reply_text("✅ Цель достигнута!")
+                                await reply("✅ Цель достигнута!")
                                 return "Задача выполнена"
                             else:
-                                await update.message.reply_text("❌ Не удалось выполнить задачу")
+                                await reply("❌ Не удалось выполнить задачу")
                                 return "Застряли в выполнении"
                         
                         current_steps = new_plan['steps']
                         
                         # Показываем новый план
-                        new_plan_text = f"📋 *Новый план* ({len(current_steps)} шагов):\n"
-                        for i, step in enumerate(current_steps, 1):
-                            action = step['action']
-                            reasoning = step.get('reasoning', '')[:40]
-                            new_plan_text += f"{i}. {action} - {reasoning}...\n"
-                        
-                        await update.message.reply_text(new_plan_text, parse_mode='Markdown')
+                        new_plan_text = NEW_PLAN_TEMPLATE.format_map({
+                            'count': len(current_steps),
+                            'body': self._format_plan(current_steps, 40),
+                        })
+                        await reply(new_plan_text, parse_mode='Markdown')
                         break  # Прерываем текущий цикл и начинаем новый план
                 else:
                     # Все шаги выполнены без replan
                     current_steps = []
             
-            # Финальная проверка
-            screenshot = self.screen.capture_secondary_monitor()
-            from self_correcting_executor import SelfCorrectingExecutor
-            executor = SelfCorrectingExecutor()
-            verification = await executor.verify_task_completion(screenshot, plan['goal'])
+            # Финальная проверка (если экран байт-в-байт как при прошлой проверке - берем ее результат)
+            screenshot = await asyncio.to_thread(self.screen.capture_secondary_monitor)
+            verification = await self._verify_screen(screenshot, goal, verified_screens)
             
             if verification.get('completed'):
-                await update.message.reply_text("✅ Задача выполнена успешно!")
+                await reply("✅ Задача выполнена успешно!")
                 return "Задача выполнена"
             else:
-                await update.message.reply_text(
+                await reply(
                     f"⚠️ Задача выполнена частично\n"
                     f"Состояние: {verification.get('explanation', '')}"
                 )
@@ -308,5 +281,5 @@ class TaskExecutor:
                 
         except Exception as e:
             logger.error(f"Ошибка выполнения: {e}", exc_info=True)
-            await update.message.reply_text(f"❌ Ошибка: {e}")
+            await reply(f"❌ Ошибка: {e}")
             return f"Ошибка: {e}"
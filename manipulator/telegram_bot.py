@@ -1,7 +1,9 @@
-import os
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.request import HTTPXRequest
 
 import config
 from command_interpreter import CommandInterpreter
@@ -12,7 +14,19 @@ logger = logging.getLogger(__name__)
 
 class JarvisBot:
     def __init__(self):
-        self.app = Application.builder().token(config.TELEGRAM_BOT_TOKEN).build()
+        # Пул для блокирующих вызовов (screencapture, osascript, Gemini SDK) -
+        # все asyncio.to_thread идут через него, event loop не блокируется
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='jarvis')
+        # Постоянные HTTP/2 соединения: reply_text за задачу десятки, без TLS handshake на каждый.
+        # getUpdates (long polling) держит соединение - ему отдельный пул
+        self.app = (
+            Application.builder()
+            .token(config.TELEGRAM_BOT_TOKEN)
+            .request(HTTPXRequest(connection_pool_size=16, read_timeout=30, http_version='2'))
+            .get_updates_request(HTTPXRequest(connection_pool_size=1, read_timeout=30, http_version='2'))
+            .post_init(self._setup_executor)
+            .build()
+        )
         self.command_interpreter = CommandInterpreter()
         self.executor = TaskExecutor()
         
@@ -21,6 +35,10 @@ class JarvisBot:
         self.app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
         self.app.add_handler(MessageHandler(filters.VOICE, self.handle_voice))
         
+    async def _setup_executor(self, application: Application):
+        """Делает пул потоков бота исполнителем по умолчанию для asyncio.to_thread"""
+        asyncio.get_running_loop().set_default_executor(self._pool)
+    
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(
             "👋 Привет! Я Jarvis - твой голосовой помощник.\n\n"
@@ -71,20 +89,16 @@ class JarvisBot:
         await update.message.reply_text("🎧 Слушаю...")
         
         try:
-            # Скачиваем голосовое сообщение
+            # Скачиваем голосовое сообщение в память (без временного файла)
             voice_file = await update.message.voice.get_file()
-            voice_path = os.path.join(config.TEMP_DIR, f"voice_{update.message.message_id}.ogg")
-            await voice_file.download_to_drive(voice_path)
-            cmd_logger.info(f"Голосовое сообщение сохранено: {voice_path}")
+            voice_data = await voice_file.download_as_bytearray()
+            cmd_logger.info(f"Голосовое сообщение получено: {len(voice_data)} байт")
             
             # Конвертируем в текст через Gemini (он умеет работать с аудио)
-            text = await self.command_interpreter.voice_to_text(voice_path)
+            text = await self.command_interpreter.voice_to_text(bytes(voice_data), mime_type='audio/ogg')
             logger.info(f"📝 Распознан текст: {text}")
             cmd_logger.info(f"Распознанный текст: {text}")
             
-            # Удаляем временный файл
-            os.remove(voice_path)
-            
             await update.message.reply_text(f"📝 Распознал: '{text}'\n\n🤔 Анализирую...")
             
             # Обрабатываем как текст
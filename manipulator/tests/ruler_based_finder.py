@@ -3,7 +3,14 @@
 Поиск координат через итеративное уточнение с линейками
 Подход: спросить координаты -> нарисовать точку + линейки -> спросить как корректировать
 """
+import asyncio
+import atexit
+import io
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import google.generativeai as genai
+import numpy as np
 from PIL import Image, ImageDraw, ImageFont
 import subprocess
 import re
@@ -17,18 +24,128 @@ import config
 
 # Настройка Gemini
 genai.configure(api_key=config.GEMINI_API_KEY)
+MODEL = genai.GenerativeModel('gemini-2.5-pro')  # НЕ 2.0!
 
-# Глобальный файл лога
-LOG_FILE = None
+# Промпты: сначала неизменная часть (одинаковый префикс на всех итерациях -
+# попадает в неявный кэш контекста Gemini 2.5), в конце - то, что меняется
+COORDS_PROMPT = '''Найди на изображении кнопку "+добавить в избранное" из Spotify.
+
+ВАЖНО: 
+- Координата (0, 0) находится в ЛЕВОМ ВЕРХНЕМ углу
+- X увеличивается ВПРАВО
+- Y увеличивается ВНИЗ
+
+ОТВЕТЬ СТРОГО в формате:
+Координаты: X Y
+Описание: где находится кнопка
+
+Пример:
+Координаты: 520 1650
+Описание: белый плюсик в сером круге справа от названия трека в плеере внизу
+'''
+COORDS_PROMPT_TAIL = '''
+РАЗМЕР ИЗОБРАЖЕНИЯ: {width}x{height} пикселей (X от 0 до {width}, Y от 0 до {height})'''
+
+VERIFY_PROMPT = '''На изображении показан УВЕЛИЧЕННЫЙ ФРАГМЕНТ экрана с КРАСНОЙ ТОЧКОЙ (кандидат для клика).
+
+ЛИНЕЙКИ РЯДОМ С ТОЧКОЙ:
+- ЖЕЛТАЯ горизонтальная линейка НИЖЕ красной точки (0 на линейке)
+- ГОЛУБАЯ вертикальная линейка СПРАВА от красной точки (0 на линейке)
+- Отрицательные значения: СЛЕВА и ВЫШЕ точки (0)
+- Положительные значения: СПРАВА и НИЖЕ точки (0)
+- Длинные метки через каждые 50 РЕАЛЬНЫХ пикселей (с подписями)
+- Короткие метки через каждые 10 РЕАЛЬНЫХ пикселей
+
+⚠️ ВАЖНО: Линейки показывают РЕАЛЬНЫЕ пиксели на оригинальном экране!
+
+ЗАДАЧА: Ты УВЕРЕН, что клик по КРАСНОЙ ТОЧКЕ активирует кнопку "+добавить в избранное" из Spotify (белый плюсик в сером круге)?
+
+🎯 ТВОЯ ЗАДАЧА:
+1. Найди кнопку "+добавить в избранное" (белый плюс в сером круге)
+2. Оцени: ГАРАНТИРУЕТ ли клик по КРАСНОЙ ТОЧКЕ активацию кнопки?
+3. Если НЕТ - используй ЛИНЕЙКИ для точного измерения сдвига
+4. Сразу посчитай ИТОГОВЫЕ координаты кнопки на экране (координаты красной точки + сдвиг)
+
+📍 ПРАВИЛА СДВИГА (используй линейки):
+- Кнопка СПРАВА от точки → Сдвиг X: ПОЛОЖИТЕЛЬНЫЙ (+)
+- Кнопка СЛЕВА от точки → Сдвиг X: ОТРИЦАТЕЛЬНЫЙ (-)
+- Кнопка НИЖЕ точки → Сдвиг Y: ПОЛОЖИТЕЛЬНЫЙ (+)
+- Кнопка ВЫШЕ точки → Сдвиг Y: ОТРИЦАТЕЛЬНЫЙ (-)
+
+Пример: чтобы попасть в кнопку, нужно сдвинуть точку на 15px ВПРАВО и 5px ВВЕРХ → Сдвиг X: +15, Сдвиг Y: -5
+Если красная точка на (500, 1600), то Итог X: 515, Итог Y: 1595
+
+⚠️ ВАЖНО:
+- Линейки калиброваны точно - "+20" = ровно 20 пикселей
+- Клик должен ГАРАНТИРОВАННО активировать кнопку
+- Используй линейки для точного измерения
+- Итоговые координаты - это ОКОНЧАТЕЛЬНЫЙ ответ, повторной коррекции может не быть
+
+ОТВЕТЬ СТРОГО в одном из форматов:
+
+1) Если ты УВЕРЕН, что клик по точке активирует кнопку:
+Точка: ВЕРНА
+
+2) Если НЕ УВЕРЕН или точка явно промахивается, укажи КОРРЕКЦИЮ и ИТОГОВЫЕ координаты:
+Точка: НЕ ВЕРНА
+Сдвиг X: [число]  (по желтой линейке)
+Сдвиг Y: [число]  (по голубой линейке)
+Итог X: [число]  (X красной точки + Сдвиг X, пиксели экрана)
+Итог Y: [число]  (Y красной точки + Сдвиг Y, пиксели экрана)
+Объяснение: где находится кнопка по линейкам
+
+Примеры:
+Точка: ВЕРНА
+
+или
+
+Точка: НЕ ВЕРНА
+Сдвиг X: 18
+Сдвиг Y: -7
+Итог X: 518
+Итог Y: 1593
+Объяснение: кнопка на "+18" (желтая) и "-7" (голубая)
+'''
+VERIFY_PROMPT_TAIL = '''
+ФРАГМЕНТ: 1000x1000px экрана, увеличен в 3 раза до {width}x{height}px
+КРАСНАЯ ТОЧКА: координаты ({current_x}, {current_y}) на экране'''
+
+# Лог в файл пишет фоновый поток (QueueListener) - основной цикл не ждет записи на диск
+_file_logger = logging.getLogger('ruler_finder')
+_file_logger.setLevel(logging.INFO)
+_file_logger.propagate = False
+_log_listener = None
+
+# Разбор ответов Gemini
+_COORDS_RE = re.compile(r'Координаты:\s*(\d+)\s+(\d+)')
+_DX_RE = re.compile(r'Сдвиг X:\s*([+-]?\d+)')
+_DY_RE = re.compile(r'Сдвиг Y:\s*([+-]?\d+)')
+_FX_RE = re.compile(r'Итог X:\s*(\d+)')
+_FY_RE = re.compile(r'Итог Y:\s*(\d+)')
+
+# Шрифт подписей линеек - загружаем один раз, а не на каждый вызов draw.text
+RULER_FONT = ImageFont.load_default()
+
+# Для поиска кнопки хватает уменьшенного скриншота: большая сторона не больше
+# COORDS_MAX_SIDE, ответ пересчитывается обратно в пиксели оригинала
+COORDS_MAX_SIDE = 1600
+
+# Все итерации пишутся в один файл - Preview сам перечитывает его при изменении,
+# поэтому `open` запускается один раз, а не на каждой итерации
+RULER_VIEW_PATH = 'screenshots/ruler_current.png'
 
 
 def init_log():
     """Инициализация файла лога"""
-    global LOG_FILE
+    global _log_listener
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
     log_path = f'logs/ruler_finder_{timestamp}.log'
     Path('logs').mkdir(exist_ok=True)
-    LOG_FILE = open(log_path, 'w', encoding='utf-8')
+    log_queue = queue.SimpleQueue()
+    _file_logger.handlers.clear()
+    _file_logger.addHandler(QueueHandler(log_queue))
+    _log_listener = QueueListener(log_queue, logging.FileHandler(log_path, 'w', encoding='utf-8'))
+    _log_listener.start()
     log(f'=== НАЧАЛО ЛОГА {timestamp} ===\n')
     return log_path
 
@@ -36,41 +153,39 @@ def init_log():
 def log(message):
     """Запись в лог и вывод на экран"""
     print(message)
-    if LOG_FILE:
-        LOG_FILE.write(message + '\n')
-        LOG_FILE.flush()
+    if _log_listener:
+        _file_logger.info(message)
 
 
 def close_log():
-    """Закрытие файла лога"""
-    if LOG_FILE:
+    """Закрытие файла лога (дописывает очередь и закрывает файл)"""
+    global _log_listener
+    if _log_listener:
         log('\n=== КОНЕЦ ЛОГА ===')
-        LOG_FILE.close()
+        _log_listener.stop()
+        for handler in _log_listener.handlers:
+            handler.close()
+        _log_listener = None
+
 
+# Если скрипт упал посередине - все равно дописываем лог
+atexit.register(close_log)
 
-def ask_gemini_coordinates(img):
+
+async def ask_gemini_coordinates(img, image_part):
     """
     Спрашивает Gemini координаты кнопки БЕЗ сетки
     
+    Args:
+        img: PIL Image, который видит Gemini (для размеров)
+        image_part: байты PNG этого изображения (без перекодирования PIL -> WebP в SDK)
+    
     Returns:
-        (x, y) или None
+        (x, y) в пикселях img или None
     """
     width, height = img.size
     
-    prompt = f'''На изображении размером {width}x{height} пикселей найди кнопку "+добавить в избранное" из Spotify.
-
-ВАЖНО: 
-- Координата (0, 0) находится в ЛЕВОМ ВЕРХНЕМ углу
-- X увеличивается ВПРАВО (от 0 до {width})
-- Y увеличивается ВНИЗ (от 0 до {height})
-
-ОТВЕТЬ СТРОГО в формате:
-Координаты: X Y
-Описание: где находится кнопка
-
-Пример:
-Координаты: 520 1650
-Описание: белый плюсик в сером круге справа от названия трека в плеере внизу'''
+    prompt = COORDS_PROMPT + COORDS_PROMPT_TAIL.format(width=width, height=height)
 
     log('📝 ПРОМПТ (запрос координат):')
     log('=' * 80)
@@ -78,14 +193,13 @@ def ask_gemini_coordinates(img):
     log('=' * 80)
     log('')
 
-    model = genai.GenerativeModel('gemini-2.5-pro')  # НЕ 2.0!
-    response = model.generate_content([prompt, img])
+    response = await MODEL.generate_content_async([prompt, image_part])
     
     answer = response.text.strip()
     log(f"📥 Ответ Gemini:\n{answer}\n")
     
     # Парсим координаты
-    coords_match = re.search(r'Координаты:\s*(\d+)\s+(\d+)', answer)
+    coords_match = _COORDS_RE.search(answer)
     if coords_match:
         x = int(coords_match.group(1))
         y = int(coords_match.group(2))
@@ -104,29 +218,32 @@ def draw_point_with_rulers(img, x, y, point_radius=8, crop_size=500, zoom_factor
         x, y: координаты точки на полном экране
         point_radius: радиус точки НА УВЕЛИЧЕННОМ изображении (маленькая 8px)
         crop_size: размер вырезаемой области вокруг точки (500 = 1000x1000px)
-        zoom_factor: во сколько раз увеличить (3 = 1500x1500px)
+        zoom_factor: во сколько раз увеличить, целое число (3 = 1500x1500px)
     
     Returns:
         PIL Image с точкой и линейками (увеличенный фрагмент)
     """
-    # 1. ВЫРЕЗАЕМ область вокруг точки
+    # 1. Область вокруг точки (вырезаем и увеличиваем одним resize с box, без промежуточной копии)
     width, height = img.size
     crop_x1 = max(0, x - crop_size)
     crop_y1 = max(0, y - crop_size)
     crop_x2 = min(width, x + crop_size)
     crop_y2 = min(height, y + crop_size)
     
-    cropped = img.crop((crop_x1, crop_y1, crop_x2, crop_y2))
-    crop_w, crop_h = cropped.size
+    crop_box = (crop_x1, crop_y1, crop_x2, crop_y2)
+    crop_w = crop_x2 - crop_x1
+    crop_h = crop_y2 - crop_y1
     
     # Координаты точки на вырезе (ДО увеличения)
     local_x = x - crop_x1
     local_y = y - crop_y1
     
-    # 2. УВЕЛИЧИВАЕМ изображение СНАЧАЛА
+    # 2. УВЕЛИЧИВАЕМ изображение СНАЧАЛА (линейки и точка рисуются прямо в этот же буфер)
+    # Целое zoom_factor + NEAREST: каждый пиксель -> квадрат zoom x zoom (как np.repeat),
+    # без свертки LANCZOS, и края кнопок остаются резкими
     zoomed_w = crop_w * zoom_factor
     zoomed_h = crop_h * zoom_factor
-    zoomed = cropped.resize((zoomed_w, zoomed_h), Image.Resampling.LANCZOS)
+    zoomed = img.resize((zoomed_w, zoomed_h), Image.Resampling.NEAREST, box=crop_box)
     
     # Координаты точки на увеличенном изображении
     zoomed_x = local_x * zoom_factor
@@ -142,6 +259,23 @@ def draw_point_with_rulers(img, x, y, point_radius=8, crop_size=500, zoom_factor
     
     # 4. ЛИНЕЙКИ РЯДОМ с точкой (0,0) = точка
     # Линейки показывают РЕАЛЬНЫЕ пиксели смещения на оригинале
+    # Метки: -crop_size до +crop_size каждые 10px. Классификацию делаем одной маской
+    # numpy (offsets % 50 == 0 - длинная метка с подписью), а не проверкой на каждой метке
+    offsets = np.arange(-crop_size, crop_size + 1, 10)
+    long_mask = offsets % 50 == 0
+    
+    # Позиции на увеличенном изображении (только те, что попадают в кадр)
+    pos_x = zoomed_x + offsets * zoom_factor
+    pos_y = zoomed_y + offsets * zoom_factor
+    in_x = (pos_x >= 0) & (pos_x <= zoomed_w)
+    in_y = (pos_y >= 0) & (pos_y <= zoomed_h)
+    
+    short_ticks = pos_x[in_x & ~long_mask].tolist()
+    short_ticks_v = pos_y[in_y & ~long_mask].tolist()
+    long_ticks = [(t, f"{off:+d}" if off else "0")
+                  for t, off in zip(pos_x[in_x & long_mask].tolist(), offsets[in_x & long_mask].tolist())]
+    long_ticks_v = [(t, f"{off:+d}" if off else "0")
+                    for t, off in zip(pos_y[in_y & long_mask].tolist(), offsets[in_y & long_mask].tolist())]
     
     # ГОРИЗОНТАЛЬНАЯ линейка (РЯДОМ с точкой, не через неё)
     ruler_h_offset = 50  # Отступ от точки
@@ -151,26 +285,16 @@ def draw_point_with_rulers(img, x, y, point_radius=8, crop_size=500, zoom_factor
     draw.line([(0, ruler_h_y), (zoomed_w, ruler_h_y)], 
               fill='yellow', width=4)
     
-    # Метки: -250 до +250 (каждые 10px реальных)
-    for real_offset in range(-crop_size, crop_size + 1, 10):
-        # Позиция на увеличенном изображении
-        tick_x = zoomed_x + (real_offset * zoom_factor)
-        if tick_x < 0 or tick_x > zoomed_w:
-            continue
-            
-        tick_y = ruler_h_y
-        
-        # Каждые 50px - длинная метка с подписью
-        if real_offset % 50 == 0:
-            draw.line([(tick_x, tick_y - 20), (tick_x, tick_y + 20)], fill='yellow', width=4)
-            label = f"{real_offset:+d}" if real_offset != 0 else "0"
-            # КРУПНЫЙ шрифт для увеличенного изображения
-            # Размещаем подписи над/под линейкой в зависимости от положения
-            text_y = tick_y + 30 if tick_y < zoomed_h / 2 else tick_y - 45
-            draw.text((tick_x - 25, text_y), label, fill='yellow', font=None)
-        else:
-            # Короткая метка (каждые 10px)
-            draw.line([(tick_x, tick_y - 10), (tick_x, tick_y + 10)], fill='yellow', width=3)
+    # Короткие метки (каждые 10px реальных)
+    for tick_x in short_ticks:
+        draw.line([(tick_x, ruler_h_y - 10), (tick_x, ruler_h_y + 10)], fill='yellow', width=3)
+    
+    # Каждые 50px - длинная метка с подписью
+    # Размещаем подписи над/под линейкой в зависимости от положения
+    text_y = ruler_h_y + 30 if ruler_h_y < zoomed_h / 2 else ruler_h_y - 45
+    for tick_x, label in long_ticks:
+        draw.line([(tick_x, ruler_h_y - 20), (tick_x, ruler_h_y + 20)], fill='yellow', width=4)
+        draw.text((tick_x - 25, text_y), label, fill='yellow', font=RULER_FONT)
     
     # ВЕРТИКАЛЬНАЯ линейка (РЯДОМ с точкой)
     ruler_v_offset = 50  # Отступ от точки
@@ -180,103 +304,42 @@ def draw_point_with_rulers(img, x, y, point_radius=8, crop_size=500, zoom_factor
     draw.line([(ruler_v_x, 0), (ruler_v_x, zoomed_h)], 
               fill='cyan', width=4)
     
-    # Метки: -250 до +250 (каждые 10px реальных)
-    for real_offset in range(-crop_size, crop_size + 1, 10):
-        # Позиция на увеличенном изображении
-        tick_y = zoomed_y + (real_offset * zoom_factor)
-        if tick_y < 0 or tick_y > zoomed_h:
-            continue
-            
-        tick_x = ruler_v_x
-        
-        # Каждые 50px - длинная метка с подписью
-        if real_offset % 50 == 0:
-            draw.line([(tick_x - 20, tick_y), (tick_x + 20, tick_y)], fill='cyan', width=4)
-            label = f"{real_offset:+d}" if real_offset != 0 else "0"
-            # КРУПНЫЙ шрифт для увеличенного изображения
-            # Размещаем подписи слева/справа в зависимости от положения
-            text_x = tick_x + 30 if tick_x < zoomed_w / 2 else tick_x - 70
-            draw.text((text_x, tick_y - 12), label, fill='cyan', font=None)
-        else:
-            # Короткая метка (каждые 10px)
-            draw.line([(tick_x - 10, tick_y), (tick_x + 10, tick_y)], fill='cyan', width=3)
+    # Короткие метки (каждые 10px реальных)
+    for tick_y in short_ticks_v:
+        draw.line([(ruler_v_x - 10, tick_y), (ruler_v_x + 10, tick_y)], fill='cyan', width=3)
+    
+    # Каждые 50px - длинная метка с подписью
+    # Размещаем подписи слева/справа в зависимости от положения
+    text_x = ruler_v_x + 30 if ruler_v_x < zoomed_w / 2 else ruler_v_x - 70
+    for tick_y, label in long_ticks_v:
+        draw.line([(ruler_v_x - 20, tick_y), (ruler_v_x + 20, tick_y)], fill='cyan', width=4)
+        draw.text((text_x, tick_y - 12), label, fill='cyan', font=RULER_FONT)
     
     # Инфо в углу
-    draw.text((10, 10), f"Координаты: ({x}, {y})", fill='white')
-    draw.text((10, 35), f"Увеличение: x{zoom_factor}", fill='white')
-    draw.text((10, 60), f"Линейки: пиксели на оригинале", fill='white')
-    draw.text((10, 85), f"Точка (0,0) = красная точка", fill='white')
+    draw.text((10, 10), f"Координаты: ({x}, {y})", fill='white', font=RULER_FONT)
+    draw.text((10, 35), f"Увеличение: x{zoom_factor}", fill='white', font=RULER_FONT)
+    draw.text((10, 60), f"Линейки: пиксели на оригинале", fill='white', font=RULER_FONT)
+    draw.text((10, 85), f"Точка (0,0) = красная точка", fill='white', font=RULER_FONT)
     
     return zoomed
 
 
-def ask_gemini_verify(img_with_point, current_x, current_y):
+async def ask_gemini_verify(img_with_point, current_x, current_y):
     """
-    Спрашивает Gemini верна ли точка, если нет - как корректировать
+    Спрашивает Gemini верна ли точка, если нет - итоговые координаты кнопки
     
     Returns:
         dict: {
             'correct': bool,
-            'delta_x': int,  # на сколько двигать по X (+ вправо, - влево)
-            'delta_y': int   # на сколько двигать по Y (+ вниз, - вверх)
+            'x': int,  # итоговые координаты на экране (абсолютные, не сдвиг)
+            'y': int
         }
     """
     width, height = img_with_point.size
     
-    prompt = f'''На изображении показан УВЕЛИЧЕННЫЙ ФРАГМЕНТ экрана (500x500px увеличен в 3 раза до {width}x{height}px).
-
-КРАСНАЯ ТОЧКА с координатами ({current_x}, {current_y}).
-
-ЛИНЕЙКИ РЯДОМ С ТОЧКОЙ:
-- ЖЕЛТАЯ горизонтальная линейка НИЖЕ красной точки (0 на линейке)
-- ГОЛУБАЯ вертикальная линейка СПРАВА от красной точки (0 на линейке)
-- Отрицательные значения: СЛЕВА и ВЫШЕ точки (0)
-- Положительные значения: СПРАВА и НИЖЕ точки (0)
-- Длинные метки через каждые 50 РЕАЛЬНЫХ пикселей (с подписями)
-- Короткие метки через каждые 10 РЕАЛЬНЫХ пикселей
-
-⚠️ ВАЖНО: Линейки показывают РЕАЛЬНЫЕ пиксели на оригинальном экране!
-
-ЗАДАЧА: Ты УВЕРЕН, что клик по координатам ({current_x}, {current_y}) активирует кнопку "+добавить в избранное" из Spotify (белый плюсик в сером круге)?
-
-🎯 ТВОЯ ЗАДАЧА:
-1. Найди кнопку "+добавить в избранное" (белый плюс в сером круге)
-2. Оцени: ГАРАНТИРУЕТ ли клик по КРАСНОЙ ТОЧКЕ активацию кнопки?
-3. Если НЕТ - используй ЛИНЕЙКИ для точного измерения сдвига
-
-📍 ПРАВИЛА СДВИГА (используй линейки):
-- Кнопка СПРАВА от точки → Сдвиг X: ПОЛОЖИТЕЛЬНЫЙ (+)
-- Кнопка СЛЕВА от точки → Сдвиг X: ОТРИЦАТЕЛЬНЫЙ (-)
-- Кнопка НИЖЕ точки → Сдвиг Y: ПОЛОЖИТЕЛЬНЫЙ (+)
-- Кнопка ВЫШЕ точки → Сдвиг Y: ОТРИЦАТЕЛЬНЫЙ (-)
-
-Пример: чтобы попасть в кнопку, нужно сдвинуть точку на 15px ВПРАВО и 5px ВВЕРХ → Сдвиг X: +15, Сдвиг Y: -5
-
-⚠️ ВАЖНО:
-- Линейки калиброваны точно - "+20" = ровно 20 пикселей
-- Клик должен ГАРАНТИРОВАННО активировать кнопку
-- Используй линейки для точного измерения
-
-ОТВЕТЬ СТРОГО в одном из форматов:
-
-1) Если ты УВЕРЕН, что клик по точке активирует кнопку:
-Точка: ВЕРНА
-
-2) Если НЕ УВЕРЕН или точка явно промахивается, укажи КОРРЕКЦИЮ:
-Точка: НЕ ВЕРНА
-Сдвиг X: [число]  (по желтой линейке)
-Сдвиг Y: [число]  (по голубой линейке)
-Объяснение: где находится кнопка по линейкам
-
-Примеры:
-Точка: ВЕРНА
-
-или
-
-Точка: НЕ ВЕРНА
-Сдвиг X: 18
-Сдвиг Y: -7
-Объяснение: кнопка на "+18" (желтая) и "-7" (голубая)'''
+    prompt = VERIFY_PROMPT + VERIFY_PROMPT_TAIL.format(
+        width=width, height=height, current_x=current_x, current_y=current_y
+    )
 
     log('📝 ПРОМПТ (проверка точки):')
     log('=' * 80)
@@ -284,8 +347,7 @@ def ask_gemini_verify(img_with_point, current_x, current_y):
     log('=' * 80)
     log('')
 
-    model = genai.GenerativeModel('gemini-2.5-pro')  # НЕ 2.0!
-    response = model.generate_content([prompt, img_with_point])
+    response = await MODEL.generate_content_async([prompt, img_with_point])
     
     answer = response.text.strip()
     log(f"📥 Ответ Gemini:\n{answer}\n")
@@ -295,30 +357,52 @@ def ask_gemini_verify(img_with_point, current_x, current_y):
     # Проверяем на "ВЕРНА"
     if 'ВЕРНА' in answer and 'НЕ ВЕРНА' not in answer:
         result['correct'] = True
-        result['delta_x'] = 0
-        result['delta_y'] = 0
+        result['x'] = current_x
+        result['y'] = current_y
         return result
     
     result['correct'] = False
     
-    # Парсим сдвиги
-    x_match = re.search(r'Сдвиг X:\s*([+-]?\d+)', answer)
-    y_match = re.search(r'Сдвиг Y:\s*([+-]?\d+)', answer)
-    
-    if x_match and y_match:
-        result['delta_x'] = int(x_match.group(1))
-        result['delta_y'] = int(y_match.group(1))
+    # Итоговые координаты, а если модель их не дала - считаем по сдвигам
+    fx_match = _FX_RE.search(answer)
+    fy_match = _FY_RE.search(answer)
+    x_match = _DX_RE.search(answer)
+    y_match = _DY_RE.search(answer)
+    
+    if fx_match and fy_match:
+        result['x'] = int(fx_match.group(1))
+        result['y'] = int(fy_match.group(1))
+    elif x_match and y_match:
+        log('⚠️ Нет итоговых координат - считаю по сдвигам')
+        result['x'] = current_x + int(x_match.group(1))
+        result['y'] = current_y + int(y_match.group(1))
     else:
-        log('❌ Не удалось распарсить сдвиги')
+        log('❌ Не удалось распарсить координаты')
         return None
     
     return result
 
 
-def iterative_refinement(screenshot_path, max_iterations=10):
+async def save_and_show(img, open_viewer=False):
+    """
+    Перезаписывает RULER_VIEW_PATH текущей итерацией (идет параллельно с запросом к Gemini)
+    
+    open_viewer: открыть файл в Preview (только в первый раз, -g - без активации окна)
+    """
+    await asyncio.to_thread(img.save, RULER_VIEW_PATH)
+    log(f'✅ Изображение: {RULER_VIEW_PATH}')
+    if open_viewer:
+        subprocess.Popen(['open', '-g', RULER_VIEW_PATH],
+                         stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+async def iterative_refinement(screenshot_path, max_iterations=10):
     """
     Итеративное уточнение координат с помощью линеек
     
+    Gemini сразу отвечает итоговыми координатами (а не сдвигом на шаг),
+    поэтому обычно хватает одной коррекции и одной контрольной проверки
+    
     Returns:
         (x, y) координаты или None
     """
@@ -332,28 +416,46 @@ def iterative_refinement(screenshot_path, max_iterations=10):
     log(f'📝 Лог сохраняется в: {log_path}')
     log('')
     
-    # Загружаем оригинал
+    # Загружаем оригинал (по нему рисуются линейки)
     original = Image.open(screenshot_path).convert('RGB')
     width, height = original.size
     log(f'📐 Размер экрана: {width}x{height}')
+    
+    # Для запроса координат уменьшаем скриншот один раз - меньше байтов и токенов
+    scale = min(1.0, COORDS_MAX_SIDE / max(width, height))
+    if scale < 1.0:
+        small = original.resize((round(width * scale), round(height * scale)), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        await asyncio.to_thread(small.save, buf, format='PNG', compress_level=1)
+        screenshot_part = {'mime_type': 'image/png', 'data': buf.getvalue()}
+        log(f'📉 Для поиска уменьшен до {small.width}x{small.height}')
+    else:
+        small = original
+        with open(screenshot_path, 'rb') as f:
+            screenshot_part = {'mime_type': 'image/png', 'data': f.read()}
     log('')
     
     # ШАГ 1: Спросить начальные координаты
     log('=' * 80)
     log('ШАГ 1: ЗАПРОС НАЧАЛЬНЫХ КООРДИНАТ')
     log('=' * 80)
-    coords = ask_gemini_coordinates(original)
+    coords = await ask_gemini_coordinates(small, screenshot_part)
     
     if not coords:
         close_log()
         return None
     
-    current_x, current_y = coords
+    # Обратно в пиксели оригинала
+    current_x = min(width, round(coords[0] / scale))
+    current_y = min(height, round(coords[1] / scale))
     log(f'✅ Начальные координаты: ({current_x}, {current_y})')
     log('')
     
     # ШАГ 2: Итеративное уточнение
     iteration = 1
+    drawn_point = None  # Точка, для которой уже нарисована и сохранена картинка
+    unchanged = 0       # Сколько итераций подряд коррекция не сдвинула точку
+    viewer_opened = False
     
     while iteration <= max_iterations:
         log('=' * 80)
@@ -361,17 +463,20 @@ def iterative_refinement(screenshot_path, max_iterations=10):
         log('=' * 80)
         log(f'Текущие координаты: ({current_x}, {current_y})')
         
-        # Рисуем точку + линейки
-        img_with_point = draw_point_with_rulers(original, current_x, current_y)
-        
-        # Сохраняем
-        iter_path = f'screenshots/ruler_iter{iteration}.png'
-        img_with_point.save(iter_path)
-        log(f'✅ Изображение: {iter_path}')
-        subprocess.run(['open', iter_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        
-        # Спрашиваем Gemini
-        result = ask_gemini_verify(img_with_point, current_x, current_y)
+        if (current_x, current_y) != drawn_point:
+            # Рисуем точку + линейки
+            img_with_point = draw_point_with_rulers(original, current_x, current_y)
+            drawn_point = (current_x, current_y)
+            
+            # Спрашиваем Gemini, пока сохраняем картинку (Preview открываем один раз)
+            result, _ = await asyncio.gather(
+                ask_gemini_verify(img_with_point, current_x, current_y),
+                save_and_show(img_with_point, open_viewer=not viewer_opened),
+            )
+            viewer_opened = True
+        else:
+            # Точка не сдвинулась - картинка на диске та же, просто переспрашиваем
+            result = await ask_gemini_verify(img_with_point, current_x, current_y)
         
         if not result:
             log('❌ Ошибка парсинга ответа')
@@ -388,17 +493,28 @@ def iterative_refinement(screenshot_path, max_iterations=10):
             return (current_x, current_y)
         
         # Применяем коррекцию
-        delta_x = result['delta_x']
-        delta_y = result['delta_y']
+        log(f'📍 Коррекция: X{result["x"] - current_x:+d}, Y{result["y"] - current_y:+d}')
         
-        log(f'📍 Коррекция: X{delta_x:+d}, Y{delta_y:+d}')
+        # Ограничиваем координаты размером экрана
+        new_x = max(0, min(width, result['x']))
+        new_y = max(0, min(height, result['y']))
         
-        current_x += delta_x
-        current_y += delta_y
+        # Неподвижная точка: нулевая коррекция или упор в край экрана -
+        # дальше Gemini получает тот же запрос, не тратим на него итерации
+        if (new_x, new_y) == (current_x, current_y):
+            unchanged += 1
+            log(f'⚠️  Точка не сдвинулась ({unchanged} раз подряд)')
+            if unchanged >= 2:
+                log('')
+                log('=' * 80)
+                log('⚠️  КОРРЕКЦИЯ НЕ ДВИГАЕТ ТОЧКУ - ВОЗВРАЩАЕМ ЛУЧШЕЕ, ЧТО ЕСТЬ')
+                log('=' * 80)
+                close_log()
+                return (current_x, current_y)
+        else:
+            unchanged = 0
         
-        # Ограничиваем координаты размером экрана
-        current_x = max(0, min(width, current_x))
-        current_y = max(0, min(height, current_y))
+        current_x, current_y = new_x, new_y
         
         log(f'➡️  Новые координаты: ({current_x}, {current_y})')
         log('')
@@ -417,7 +533,7 @@ if __name__ == '__main__':
     # Тест
     screenshot = 'screenshots/screenshot_1759682765.png'
     
-    result = iterative_refinement(screenshot, max_iterations=10)
+    result = asyncio.run(iterative_refinement(screenshot))
     
     if result:
         x, y = result
@@ -6,9 +6,12 @@
 логирует все действия в файл и консоль.
 """
 import asyncio
+import atexit
 import logging
+import queue
 import sys
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
 
 # Настройка максимального логирования
@@ -30,11 +33,17 @@ file_handler = logging.FileHandler(log_file, encoding='utf-8')
 file_handler.setLevel(logging.DEBUG)
 file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 
-# Добавляем file handler ко всем логгерам
+# В файл пишет фоновый поток (QueueListener) - DEBUG записи планировщика и executor'а
+# не ждут диска в event loop. Handler вешаем только на корневой логгер: остальные
+# пропагируют в него (иначе каждая их запись попадала в файл дважды)
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.getLogger().addHandler(QueueHandler(log_queue))
+
 for logger_name in ['', 'iterative_planner', 'self_correcting_executor', 'screen_manager']:
-    logger = logging.getLogger(logger_name)
-    logger.addHandler(file_handler)
-    logger.setLevel(logging.DEBUG)
+    logging.getLogger(logger_name).setLevel(logging.DEBUG)
 
 logger = logging.getLogger(__name__)
 
@@ -52,11 +61,9 @@ class FakeUpdate:
     """Заглушка для Update из Telegram"""
     class FakeMessage:
         async def reply_text(self, text, parse_mode=None):
-            print(f"\n{'='*70}")
-            print(f"📱 [BOT MESSAGE]")
-            print(f"{'='*70}")
-            print(text)
-            print(f"{'='*70}\n")
+            # Одна запись вместо пяти print - и один flush на сообщение
+            sys.stdout.write(f"\n{'='*70}\n📱 [BOT MESSAGE]\n{'='*70}\n{text}\n{'='*70}\n\n")
+            sys.stdout.flush()
     
     def __init__(self):
         self.message = self.FakeMessage()
@@ -90,6 +97,8 @@ async def execute_app_task(task_plan: str, planner: IterativePlanner, screen: Sc
         steps_done = []
         current_steps = plan['steps']
         monitor_info = screen.get_secondary_monitor_info()
+        # Один verifier на всю задачу (как self._verifier в TaskExecutor)
+        executor = SelfCorrectingExecutor(screen)
         
         replan_counter = 0
         max_replans = 10
@@ -118,36 +127,44 @@ async def execute_app_task(task_plan: str, planner: IterativePlanner, screen: Sc
                     replan_counter += 1
                     await fake_update.message.reply_text(f"🔄 Анализирую ситуацию... (replan {replan_counter}/{max_replans})")
                     
-                    # Делаем скриншот
-                    screenshot = screen.capture_secondary_monitor()
+                    # Делаем скриншот каждый раз - приложение обновляет экран и само
+                    # (как в TaskExecutor._run_plan_loop)
+                    screenshot = await asyncio.to_thread(screen.capture_secondary_monitor, image_format='jpg')
                     await asyncio.sleep(1)
                     
-                    # Определяем текущее состояние
-                    executor = SelfCorrectingExecutor(screen)
-                    verification = await executor.verify_task_completion(screenshot, plan['goal'])
-                    
-                    current_state = verification.get('explanation', 'Состояние неизвестно')
-                    
-                    logger.info(f"🔍 Текущее состояние: {current_state}")
-                    logger.info(f"   Задача выполнена: {verification.get('completed')}")
-                    
-                    # Проверяем завершение
-                    if verification.get('completed'):
-                        await fake_update.message.reply_text("✅ Задача выполнена!")
-                        return "Задача выполнена успешно"
-                    
-                    # Запрашиваем новый план
-                    logger.info(f"📝 Запрашиваю новый план...")
+                    # Проверка и replan - два независимых запроса к Gemini по одному скриншоту,
+                    # запускаем их одновременно. Цена: replan не получает explanation
+                    # верификатора (его еще нет) - состояние для него только результат
+                    # последнего шага, а текущий экран replan видит сам на скриншоте
+                    step_state = f"После шага {step_desc}: {result['result']}"
+                    logger.info(f"📝 Запрашиваю новый план (параллельно с проверкой)...")
                     logger.info(f"   Оригинальная цель: {plan['goal']}")
-                    logger.info(f"   Текущее состояние: {current_state}")
+                    logger.info(f"   Текущее состояние: {step_state}")
                     logger.info(f"   Шаги выполнены: {steps_done}")
                     
-                    new_plan = await planner.replan(
+                    replan_task = asyncio.create_task(planner.replan(
                         screenshot_path=screenshot,
                         original_goal=plan['goal'],
-                        current_state=current_state,
-                        steps_done=steps_done
-                    )
+                        current_state=step_state,
+                        steps_done=list(steps_done)
+                    ))
+                    try:
+                        # Определяем текущее состояние
+                        verification = await executor.verify_task_completion(screenshot, plan['goal'])
+                        
+                        current_state = verification.get('explanation', 'Состояние неизвестно')
+                        
+                        logger.info(f"🔍 Текущее состояние: {current_state}")
+                        logger.info(f"   Задача выполнена: {verification.get('completed')}")
+                        
+                        # Проверяем завершение - новый план уже не нужен
+                        if verification.get('completed'):
+                            await fake_update.message.reply_text("✅ Задача выполнена!")
+                            return "Задача выполнена успешно"
+                        
+                        new_plan = await replan_task
+                    finally:
+                        replan_task.cancel()
                     
                     if not new_plan.get('steps'):
                         # Или цель достигнута, или застряли
@@ -177,9 +194,8 @@ async def execute_app_task(task_plan: str, planner: IterativePlanner, screen: Sc
             await fake_update.message.reply_text(f"⚠️ Достигнут лимит replans ({max_replans})")
             return "Достигнут лимит replans"
         
-        # Финальная проверка
-        screenshot = screen.capture_secondary_monitor()
-        executor = SelfCorrectingExecutor(screen)
+        # Финальная проверка - по свежему скриншоту
+        screenshot = await asyncio.to_thread(screen.capture_secondary_monitor, image_format='jpg')
         verification = await executor.verify_task_completion(screenshot, plan['goal'])
         
         if verification.get('completed'):
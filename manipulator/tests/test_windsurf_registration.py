@@ -17,8 +17,11 @@
 """
 
 import asyncio
+import json
 import logging
+import os
 import sys
+from functools import lru_cache
 from pathlib import Path
 
 # Добавляем корневую директорию в путь
@@ -27,6 +30,8 @@ sys.path.insert(0, str(Path(__file__).parent.parent))
 from iterative_planner import IterativePlanner
 from screen_manager import ScreenManager
 from browser_controller import BrowserController
+from chrome_mcp_integration import get_chrome_mcp_integration, close_chrome_mcp_integration
+from response_cache import prompt_key
 import config
 
 # Настройка логирования
@@ -41,71 +46,225 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def test_windsurf_registration():
+# ScreenManager (Quartz список мониторов, детектор активности) и BrowserController
+# создаются один раз на процесс и переиспользуются всеми тестами.
+# IterativePlanner НЕ кэшируем - у него история неудачных действий на задачу
+# (main() передает один планировщик в оба теста, каждый тест сбрасывает его состояние)
+@lru_cache(maxsize=None)
+def _screen(wait_for_user_idle: bool) -> ScreenManager:
+    return ScreenManager(wait_for_user_idle=wait_for_user_idle)
+
+
+@lru_cache(maxsize=None)
+def _browser(screen: ScreenManager) -> BrowserController:
+    return BrowserController(browser='Chrome', screen=screen)
+
+
+# Задачи для планировщика на уровне модуля - планы для них можно
+# запросить у Gemini заранее, пока идет первый тест (см. main)
+TASK_TEMP_EMAIL = """
+Открой сайт 10minutemail.com и получи временный email адрес.
+Задача:
+1. Открыть 10minutemail.com
+2. Подождать загрузки страницы
+3. Найти и скопировать email адрес
+"""
+
+TASK_WINDSURF_SIGNUP = """
+Зарегистрировать новый аккаунт на сайте Windsurf.
+
+Задача:
+1. Открыть сайт codeium.com/windsurf или найти страницу регистрации
+2. Найти и кликнуть на кнопку регистрации (Sign Up, Get Started, Register и т.д.)
+3. Заполнить форму регистрации:
+   - Email: использовать адрес с 10minutemail (получить через JavaScript со страницы 10minutemail)
+   - Пароль: TestPassword123! (если требуется)
+   - Имя: Test User (если требуется)
+4. Отправить форму регистрации
+
+ВАЖНО: 
+- НЕ hardcode никакие селекторы - система должна САМА найти элементы
+- Используй MCP действия где возможно
+- Если MCP не работает - автоматически сработает fallback на VISUAL_CLICK
+"""
+
+
+class PlanCache:
+    """
+    Планы (с селекторами MCP) между запусками теста - JSON файл в logs/
+    
+    Повторный запуск не ждет Gemini на create_initial_plan. Запись удаляется,
+    если шаг из нее не сработал или селектора больше нет на странице
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        try:
+            self._plans = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            self._plans = {}
+    
+    def get(self, task: str):
+        return self._plans.get(prompt_key(task))
+    
+    def put(self, task: str, plan: dict):
+        self._plans[prompt_key(task)] = plan
+        self._save()
+    
+    def invalidate(self, task: str):
+        if self._plans.pop(prompt_key(task), None) is not None:
+            logger.info("🗑️ План удален из кэша")
+            self._save()
+    
+    def _save(self):
+        self.path.write_text(json.dumps(self._plans, ensure_ascii=False, indent=2), encoding='utf-8')
+
+
+plan_cache = PlanCache(Path('logs/windsurf_plan_cache.json'))
+
+
+def _truncate(text, limit: int = 200) -> str:
+    """Обрезает результат шага для лога (MCP может вернуть целый snapshot страницы)"""
+    text = str(text)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+async def _get_plan(planner: IterativePlanner, task: str) -> tuple:
+    """Возвращает (план, из_кэша)"""
+    plan = plan_cache.get(task)
+    if plan is not None:
+        logger.info(f"♻️ План из кэша: {len(plan['steps'])} шагов")
+        return plan, True
+    plan = await planner.create_initial_plan(task)
+    if plan.get('steps'):
+        plan_cache.put(task, plan)
+    return plan, False
+
+
+async def _selector_exists(selector: str) -> bool:
+    """Дешевая проверка document.querySelector(selector) через MCP"""
+    mcp = await get_chrome_mcp_integration()
+    code = f"document.querySelector({json.dumps(selector)}) !== null"
+    result = await mcp.execute_action('MCP_EXECUTE_JS', {'code': code})
+    content = getattr(result.get('data'), 'content', None) or []
+    return any('true' in (getattr(part, 'text', '') or '') for part in content)
+
+
+async def _run_plan_steps(planner: IterativePlanner, task: str, monitor_info: dict, steps_done: list = None):
+    """Выполняет шаги плана задачи; план из кэша проверяется и при сбое удаляется из кэша"""
+    plan, from_cache = await _get_plan(planner, task)
+    total = len(plan['steps'])
+    logger.info("📋 План: %d шагов", total)
+    
+    for i, step in enumerate(plan['steps'], 1):
+        logger.info("\n▶️  Шаг %d/%d: %s", i, total, step['action'])
+        
+        selector = step.get('params', {}).get('selector')
+        if from_cache and selector and step['action'] in ('MCP_CLICK', 'MCP_TYPE'):
+            if not await _selector_exists(selector):
+                logger.info("⚠️ Селектора из кэша нет на странице: %s", selector)
+                plan_cache.invalidate(task)
+                from_cache = False
+        
+        result = await planner.execute_step(step, monitor_info)
+        
+        if result['success']:
+            logger.info("✅ %s", _truncate(result['result']))
+        else:
+            logger.warning("⚠️ %s", _truncate(result['result']))
+        
+        if steps_done is not None:
+            steps_done.append(f"{step['action']} {step.get('params', {})}")
+        
+        if result.get('needs_replan'):
+            logger.info("🔄 Требуется replan...")
+            if from_cache:
+                plan_cache.invalidate(task)
+            break
+        
+        await _wait_ready()
+    
+    return plan
+
+
+def _planner(screen: ScreenManager) -> IterativePlanner:
+    planner = IterativePlanner(api_key=config.GEMINI_API_KEY, screen_manager=screen)
+    planner.is_browser_task = True  # Активируем MCP режим
+    return planner
+
+
+async def _prefetch_plans(planner: IterativePlanner):
+    """
+    Заполняет plan_cache планами для TASK_* (только сеть, браузер не трогает)
+    
+    create_initial_plan ждет Gemini в отдельном потоке, поэтому event loop свободен:
+    тест 1 и его _wait_ready идут параллельно, а оба плана запрашиваются одновременно
+    """
+    await asyncio.gather(*(_get_plan(planner, task) for task in (TASK_TEMP_EMAIL, TASK_WINDSURF_SIGNUP)))
+
+
+async def _wait_ready(timeout: float = 10.0) -> bool:
+    """
+    Ждет document.readyState == 'complete' через MCP вместо фиксированной паузы
+    
+    Опрос с растущим интервалом (0.1с * 1.5^n): загруженная страница отвечает с первого раза
+    """
+    mcp = await get_chrome_mcp_integration()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    delay = 0.1
+    while True:
+        result = await mcp.execute_action('MCP_EXECUTE_JS', {'code': 'document.readyState'})
+        content = getattr(result.get('data'), 'content', None) or []
+        if any('complete' in (getattr(part, 'text', '') or '') for part in content):
+            return True
+        if loop.time() >= deadline:
+            logger.warning(f"⚠️ Страница не загрузилась за {timeout}с, продолжаю")
+            return False
+        await asyncio.sleep(delay)
+        delay *= 1.5
+
+
+async def test_windsurf_registration(screen: ScreenManager = None, planner: IterativePlanner = None):
     """
     Полный сценарий регистрации Windsurf
+    
+    screen/planner передает main() - браузер тогда уже открыт, а MCP закрывает main().
+    Без них (отдельный запуск) тест сам открывает Chrome и закрывает MCP
     """
     logger.info("=" * 80)
     logger.info("ТЕСТ: РЕГИСТРАЦИЯ WINDSURF НА ВРЕМЕННУЮ ПОЧТУ")
     logger.info("=" * 80)
     
     # Инициализация
-    screen = ScreenManager(wait_for_user_idle=config.WAIT_FOR_USER_IDLE)
-    browser = BrowserController(browser='Chrome', screen=screen)
-    planner = IterativePlanner(api_key=config.GEMINI_API_KEY, screen_manager=screen)
-    planner.is_browser_task = True  # Активируем MCP режим
+    standalone = screen is None
+    screen = screen or _screen(config.WAIT_FOR_USER_IDLE)
+    planner = planner or _planner(screen)
+    planner.reset_task_state()
     
     try:
-        # Шаг 1: Открываем браузер
-        logger.info("\n" + "=" * 60)
-        logger.info("ШАГ 1: Открытие Chrome на втором мониторе")
-        logger.info("=" * 60)
-        
-        await browser.open_on_secondary_monitor()
-        await asyncio.sleep(3)
-        
-        logger.info("✅ Chrome открыт")
+        if standalone:
+            # Шаг 1: Открываем браузер
+            logger.info("\n" + "=" * 60)
+            logger.info("ШАГ 1: Открытие Chrome на втором мониторе")
+            logger.info("=" * 60)
+            
+            await _open_browser(screen)
         
         # Шаг 2: Создаем план для временной почты
         logger.info("\n" + "=" * 60)
         logger.info("ШАГ 2: Получение временного email")
         logger.info("=" * 60)
         
-        task_1 = """
-        Открой сайт 10minutemail.com и получи временный email адрес.
-        Задача:
-        1. Открыть 10minutemail.com
-        2. Подождать загрузки страницы
-        3. Найти и скопировать email адрес
-        """
-        
-        plan_1 = await planner.create_initial_plan(task_1)
-        logger.info(f"📋 План создан: {len(plan_1['steps'])} шагов")
-        
         # Выполняем план 1
         monitor_info = screen.get_secondary_monitor_info()
         steps_done = []
+        await _run_plan_steps(planner, TASK_TEMP_EMAIL, monitor_info, steps_done)
         
-        for i, step in enumerate(plan_1['steps'], 1):
-            logger.info(f"\n▶️  Шаг {i}/{len(plan_1['steps'])}: {step['action']}")
-            result = await planner.execute_step(step, monitor_info)
-            
-            if result['success']:
-                logger.info(f"✅ {result['result']}")
-            else:
-                logger.warning(f"⚠️ {result['result']}")
-            
-            steps_done.append(f"{step['action']} {step.get('params', {})}")
-            
-            if result.get('needs_replan'):
-                logger.info("🔄 Требуется replan...")
-                break
-            
-            await asyncio.sleep(1)
-        
-        # Даем время посмотреть на результат
-        logger.info("\n⏸️  Пауза 5 секунд для проверки email...")
-        await asyncio.sleep(5)
+        # Даем время посмотреть на результат (только при ручном запуске)
+        if sys.stdin.isatty():
+            logger.info("\n⏸️  Пауза 5 секунд для проверки email...")
+            await asyncio.sleep(5)
         
         # Шаг 3: Windsurf регистрация
         logger.info("\n" + "=" * 60)
@@ -120,46 +279,10 @@ async def test_windsurf_registration():
             'params': {'code': js_code}
         }
         result_js = await planner.execute_step(step_js, monitor_info)
-        logger.info(f"📧 Email: {result_js['result']}")
-        
-        # Теперь создаем план для регистрации Windsurf
-        task_2 = """
-        Зарегистрировать новый аккаунт на сайте Windsurf.
+        logger.info("📧 Email: %s", _truncate(result_js['result']))
         
-        Задача:
-        1. Открыть сайт codeium.com/windsurf или найти страницу регистрации
-        2. Найти и кликнуть на кнопку регистрации (Sign Up, Get Started, Register и т.д.)
-        3. Заполнить форму регистрации:
-           - Email: использовать адрес с 10minutemail (получить через JavaScript со страницы 10minutemail)
-           - Пароль: TestPassword123! (если требуется)
-           - Имя: Test User (если требуется)
-        4. Отправить форму регистрации
-        
-        ВАЖНО: 
-        - НЕ hardcode никакие селекторы - система должна САМА найти элементы
-        - Используй MCP действия где возможно
-        - Если MCP не работает - автоматически сработает fallback на VISUAL_CLICK
-        """
-        
-        plan_2 = await planner.create_initial_plan(task_2)
-        logger.info(f"📋 План регистрации создан: {len(plan_2['steps'])} шагов")
-        
-        # Выполняем план 2
-        for i, step in enumerate(plan_2['steps'], 1):
-            logger.info(f"\n▶️  Шаг {i}/{len(plan_2['steps'])}: {step['action']}")
-            result = await planner.execute_step(step, monitor_info)
-            
-            if result['success']:
-                logger.info(f"✅ {result['result']}")
-            else:
-                logger.warning(f"⚠️ {result['result']}")
-            
-            if result.get('needs_replan'):
-                logger.info("🔄 Требуется переплан...")
-                # Можем добавить replan логику
-                break
-            
-            await asyncio.sleep(1)
+        # Теперь выполняем план регистрации Windsurf
+        await _run_plan_steps(planner, TASK_WINDSURF_SIGNUP, monitor_info)
         
         # Финальная проверка
         logger.info("\n" + "=" * 60)
@@ -189,33 +312,32 @@ async def test_windsurf_registration():
         return False
         
     finally:
-        # Cleanup
-        logger.info("\n🧹 Cleanup...")
-        
-        # Закрываем MCP соединение
-        from chrome_mcp_integration import close_chrome_mcp_integration
-        await close_chrome_mcp_integration()
-        
-        logger.info("✅ Cleanup завершен")
+        if standalone:
+            await _cleanup()
 
 
-async def test_mcp_basic_actions():
+async def test_mcp_basic_actions(screen: ScreenManager = None, planner: IterativePlanner = None):
     """
     Базовая проверка MCP действий без полной регистрации
+    
+    screen/planner - как в test_windsurf_registration
     """
     logger.info("\n" + "=" * 80)
     logger.info("ТЕСТ: БАЗОВЫЕ MCP ДЕЙСТВИЯ")
     logger.info("=" * 80)
     
-    screen = ScreenManager(wait_for_user_idle=False)  # Без ожидания для теста
-    browser = BrowserController(browser='Chrome', screen=screen)
-    planner = IterativePlanner(api_key=config.GEMINI_API_KEY, screen_manager=screen)
-    planner.is_browser_task = True
+    standalone = screen is None
+    screen = screen or _screen(False)
+    planner = planner or _planner(screen)
+    planner.reset_task_state()
+    
+    # Без ожидания бездействия для теста - и на общем ScreenManager тоже
+    wait_for_user_idle = screen.wait_for_user_idle
+    screen.wait_for_user_idle = False
     
     try:
-        # Открываем браузер
-        await browser.open_on_secondary_monitor()
-        await asyncio.sleep(2)
+        if standalone:
+            await _open_browser(screen)
         
         monitor_info = screen.get_secondary_monitor_info()
         
@@ -226,8 +348,8 @@ async def test_mcp_basic_actions():
             'params': {'url': 'https://example.com'}
         }
         result1 = await planner.execute_step(step1, monitor_info)
-        logger.info(f"{'✅' if result1['success'] else '❌'} MCP_NAVIGATE: {result1['result']}")
-        await asyncio.sleep(2)
+        logger.info("%s MCP_NAVIGATE: %s", '✅' if result1['success'] else '❌', _truncate(result1['result']))
+        await _wait_ready()
         
         # Тест 2: MCP_EXECUTE_JS
         logger.info("\n📝 Тест 2: MCP_EXECUTE_JS")
@@ -236,8 +358,7 @@ async def test_mcp_basic_actions():
             'params': {'code': 'document.title'}
         }
         result2 = await planner.execute_step(step2, monitor_info)
-        logger.info(f"{'✅' if result2['success'] else '❌'} MCP_EXECUTE_JS: {result2['result']}")
-        await asyncio.sleep(1)
+        logger.info("%s MCP_EXECUTE_JS: %s", '✅' if result2['success'] else '❌', _truncate(result2['result']))
         
         # Тест 3: MCP_CLICK (будет fallback если селектор неверный)
         logger.info("\n📝 Тест 3: MCP_CLICK (fallback тест)")
@@ -245,8 +366,14 @@ async def test_mcp_basic_actions():
             'action': 'MCP_CLICK',
             'params': {'selector': 'a'}  # Первая ссылка
         }
-        result3 = await planner.execute_step(step3, monitor_info)
-        logger.info(f"{'✅' if result3['success'] else '⚠️'} MCP_CLICK: {result3['result']}")
+        # Дешевая проверка селектора: если ссылки нет, MCP_CLICK все равно ушел бы
+        # в медленный VISUAL_CLICK fallback (скриншот + Vision) - засчитываем как fallback
+        if await _selector_exists(step3['params']['selector']):
+            result3 = await planner.execute_step(step3, monitor_info)
+        else:
+            logger.info("⏭️ Ссылок на странице нет - MCP_CLICK пропущен")
+            result3 = {'success': False, 'result': 'Селектор не найден', 'needs_replan': True}
+        logger.info("%s MCP_CLICK: %s", '✅' if result3['success'] else '⚠️', _truncate(result3['result']))
         
         # Итоги
         logger.info("\n" + "=" * 60)
@@ -268,22 +395,48 @@ async def test_mcp_basic_actions():
         return False
         
     finally:
-        from chrome_mcp_integration import close_chrome_mcp_integration
-        await close_chrome_mcp_integration()
+        screen.wait_for_user_idle = wait_for_user_idle
+        if standalone:
+            await _cleanup()
 
 
-async def main():
-    """Запуск всех тестов"""
-    logger.info("\n" + "🧪" * 40)
-    logger.info("ЗАПУСК ТЕСТОВ WINDSURF РЕГИСТРАЦИИ")
-    logger.info("🧪" * 40 + "\n")
+async def _open_browser(screen: ScreenManager):
+    """Открывает Chrome и ждет загрузки страницы"""
+    await _browser(screen).open_on_secondary_monitor()
+    await _wait_ready()
+    logger.info("✅ Chrome открыт")
+
+
+async def _cleanup():
+    logger.info("\n🧹 Cleanup...")
+    
+    # Закрываем MCP соединение
+    await close_chrome_mcp_integration()
     
+    logger.info("✅ Cleanup завершен")
+
+
+async def _run_tests(screen: ScreenManager, planner: IterativePlanner) -> tuple:
+    """Оба теста на общих screen/planner (браузер уже открыт)"""
     # Тест 1: Базовые MCP действия
     logger.info("\n" + "=" * 80)
     logger.info("ТЕСТ 1: Базовые MCP действия")
     logger.info("=" * 80)
     
-    test1_result = await test_mcp_basic_actions()
+    # Оба теста работают с одной вкладкой Chrome, одним MCP singleton и
+    # реальной мышью, поэтому сами тесты идут последовательно. Параллельно
+    # с тестом 1 идут только запросы планов к Gemini для теста 2
+    if os.environ.get('JARVIS_TEST_SERIAL') == '1':
+        test1_result = await test_mcp_basic_actions(screen, planner)
+    else:
+        test1_result, prefetch_result = await asyncio.gather(
+            test_mcp_basic_actions(screen, planner), _prefetch_plans(planner), return_exceptions=True
+        )
+        if isinstance(prefetch_result, Exception):
+            logger.warning(f"⚠️ Не удалось заранее получить планы: {prefetch_result}")
+        if isinstance(test1_result, Exception):
+            logger.error(f"❌ Тест 1 упал: {test1_result}")
+            test1_result = False
     await asyncio.sleep(2)
     
     # Тест 2: Полный сценарий (demo)
@@ -291,7 +444,24 @@ async def main():
     logger.info("ТЕСТ 2: Полный сценарий регистрации")
     logger.info("=" * 80)
     
-    test2_result = await test_windsurf_registration()
+    test2_result = await test_windsurf_registration(screen, planner)
+    return test1_result, test2_result
+
+
+async def main():
+    """Запуск всех тестов"""
+    logger.info("\n" + "🧪" * 40)
+    logger.info("ЗАПУСК ТЕСТОВ WINDSURF РЕГИСТРАЦИИ")
+    logger.info("🧪" * 40 + "\n")
+    
+    # Один ScreenManager/планировщик и одно окно Chrome на оба теста
+    screen = _screen(config.WAIT_FOR_USER_IDLE)
+    planner = _planner(screen)
+    try:
+        await _open_browser(screen)
+        test1_result, test2_result = await _run_tests(screen, planner)
+    finally:
+        await _cleanup()
     
     # Финальные итоги
     logger.info("\n" + "=" * 80)
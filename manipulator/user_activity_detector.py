@@ -1,15 +1,46 @@
 """
 Детектор активности пользователя для безопасной параллельной работы
 """
+import asyncio
 import time
 import logging
+import objc
 from Quartz import CGEventSourceCreate, kCGEventSourceStateHIDSystemState, CGEventSourceCounterForEventType
 from Quartz import kCGEventMouseMoved, kCGEventLeftMouseDown, kCGEventRightMouseDown
+from Quartz import CGEventCreate, CGEventGetLocation, CGEventSourceSecondsSinceLastEventType
 import subprocess
 import os
 
 logger = logging.getLogger(__name__)
 
+# События, которые считаются активностью пользователя (мышь)
+MOUSE_EVENT_TYPES = (kCGEventMouseMoved, kCGEventLeftMouseDown, kCGEventRightMouseDown)
+
+# Уведомление: заголовок и текст идут аргументами osascript, исходник один на все вызовы
+NOTIFICATION_SCRIPT = '''
+on run argv
+    display notification (item 2 of argv) with title (item 1 of argv) sound name "Glass"
+end run
+'''
+
+
+def _cursor_xy():
+    """
+    Позиция курсора (x, y) напрямую от window server (те же глобальные координаты,
+    что и CGDisplayBounds) - без запуска osascript. None, если Quartz не ответил
+    """
+    try:
+        location = CGEventGetLocation(CGEventCreate(None))
+        return location.x, location.y
+    except Exception as e:
+        logger.debug(f"Не удалось определить позицию курсора: {e}")
+        return None
+
+
+def _contains(bounds: tuple, x: float, y: float) -> bool:
+    x1, y1, x2, y2 = bounds
+    return x1 <= x < x2 and y1 <= y < y2
+
 
 class UserActivityDetector:
     """
@@ -20,37 +51,50 @@ class UserActivityDetector:
         self.last_mouse_position = None
         self.last_check_time = time.time()
         self.event_source = CGEventSourceCreate(kCGEventSourceStateHIDSystemState)
+        # Границы мониторов (x1, y1, x2, y2) - считаются один раз на список displays
+        self._bounds_displays = None
+        self._display_bounds = ()
         
     def get_mouse_events_count(self):
-        """Возвращает количество событий мыши с момента запуска системы"""
+        """
+        Возвращает количество событий мыши с момента запуска системы
+        
+        Само ожидание бездействия счетчики больше не опрашивает (см. seconds_since_mouse_event)
+        """
+        source = self.event_source
         try:
-            moves = CGEventSourceCounterForEventType(self.event_source, kCGEventMouseMoved)
-            left_clicks = CGEventSourceCounterForEventType(self.event_source, kCGEventLeftMouseDown)
-            right_clicks = CGEventSourceCounterForEventType(self.event_source, kCGEventRightMouseDown)
-            return moves + left_clicks + right_clicks
-        except:
+            return sum(CGEventSourceCounterForEventType(source, event_type) for event_type in MOUSE_EVENT_TYPES)
+        except (TypeError, ValueError, OSError, objc.error):
+            # Quartz вернул None / невалидный источник событий
             return 0
     
+    def seconds_since_mouse_event(self) -> float:
+        """Сколько секунд прошло с последнего события мыши (по данным window server)"""
+        return min(
+            CGEventSourceSecondsSinceLastEventType(kCGEventSourceStateHIDSystemState, event_type)
+            for event_type in MOUSE_EVENT_TYPES
+        )
+    
     def is_user_active(self, check_duration: float = 0.1) -> bool:
         """
         Проверяет, активен ли пользователь (двигает мышкой)
         
+        Не ждет check_duration: window server сам знает время последнего события
+        
         Args:
-            check_duration: Сколько секунд проверять активность
+            check_duration: За сколько последних секунд учитывать активность
             
         Returns:
-            True если пользователь двигает мышкой, False если нет
+            True если пользователь двигал мышкой за последние check_duration секунд
         """
-        start_count = self.get_mouse_events_count()
-        time.sleep(check_duration)
-        end_count = self.get_mouse_events_count()
-        
-        return end_count > start_count
+        return self.seconds_since_mouse_event() < check_duration
     
     def wait_for_idle(self, idle_seconds: float = 2.0, show_notification: bool = True) -> bool:
         """
         Ждёт, пока пользователь не прекратит двигать мышкой
         
+        Блокирует поток - из async кода используйте wait_for_idle_async
+        
         Args:
             idle_seconds: Сколько секунд бездействия нужно
             show_notification: Показывать ли уведомление пользователю
@@ -58,58 +102,83 @@ class UserActivityDetector:
         Returns:
             True если дождались, False если таймаут (максимум 30 секунд)
         """
+        waits = self._idle_waits(idle_seconds, show_notification)
+        try:
+            while True:
+                time.sleep(next(waits))
+        except StopIteration as done:
+            return done.value
+    
+    async def wait_for_idle_async(self, idle_seconds: float = 2.0, show_notification: bool = True) -> bool:
+        """То же, что wait_for_idle, но паузы через asyncio.sleep - event loop не блокируется"""
+        waits = self._idle_waits(idle_seconds, show_notification)
+        try:
+            while True:
+                await asyncio.sleep(next(waits))
+        except StopIteration as done:
+            return done.value
+    
+    def _idle_waits(self, idle_seconds: float, show_notification: bool):
+        """
+        Логика ожидания бездействия без самих пауз: генератор отдает, сколько спать
+        до следующей проверки, и возвращает (StopIteration.value) итог ожидания
+        
+        Общая для sync и async версий wait_for_idle
+        """
         max_wait_time = 30.0
-        start_wait = time.time()
+        start_wait = time.monotonic()
         notification_shown = False
         
         logger.info(f"⏳ Проверка активности пользователя...")
         
         while True:
+            # Время бездействия берем прямо у window server - не нужно
+            # ни засекать его самим, ни ждать check_duration на каждой проверке
+            idle_duration = self.seconds_since_mouse_event()
+            if idle_duration >= idle_seconds:
+                logger.info(f"✅ Пользователь неактивен {idle_duration:.1f}s, продолжаю")
+                return True
+            
             # Проверяем, не истёк ли максимальный таймаут
-            elapsed = time.time() - start_wait
+            elapsed = time.monotonic() - start_wait
             if elapsed > max_wait_time:
                 logger.warning(f"⚠️ Таймаут ожидания бездействия ({max_wait_time}s)")
                 return False
             
-            # Проверяем активность
-            if self.is_user_active(check_duration=0.2):
+            if idle_duration < 0.2 and show_notification and not notification_shown:
                 # Пользователь активен — показываем уведомление
-                if show_notification and not notification_shown:
-                    self._show_notification(
-                        "Jarvis ждёт",
-                        f"Освободите мышку на {idle_seconds} секунды"
-                    )
-                    notification_shown = True
-                    logger.info(f"👤 Пользователь активен, жду бездействия...")
-                
-                # Сбрасываем таймер бездействия
-                start_wait = time.time()
-                time.sleep(0.5)
-                continue
+                self._show_notification(
+                    "Jarvis ждёт",
+                    f"Освободите мышку на {idle_seconds} секунды"
+                )
+                notification_shown = True
+                logger.info(f"👤 Пользователь активен, жду бездействия...")
             
-            # Пользователь неактивен — проверяем, прошло ли достаточно времени
-            idle_duration = time.time() - start_wait
-            if idle_duration >= idle_seconds:
-                logger.info(f"✅ Пользователь неактивен {idle_duration:.1f}s, продолжаю")
-                return True
-            
-            time.sleep(0.2)
+            # Спим ровно до момента, когда бездействие достигнет idle_seconds (если мышь
+            # за это время не трогали - следующая проверка сразу вернет True)
+            yield min(max(0.02, idle_seconds - idle_duration), max_wait_time - elapsed)
     
     def _show_notification(self, title: str, message: str):
-        """Показывает macOS уведомление"""
+        """
+        Показывает macOS уведомление
+        
+        Не ждет завершения osascript - ожидание бездействия идет сразу, параллельно с показом
+        """
         try:
-            # Экранируем кавычки в сообщении
-            safe_message = message.replace('"', '\\"').replace("'", "\\'")
-            safe_title = title.replace('"', '\\"').replace("'", "\\'")
-            
-            apple_script = f'''
-            display notification "{safe_message}" with title "{safe_title}" sound name "Glass"
-            '''
-            subprocess.run(['osascript', '-e', apple_script], 
-                         capture_output=True, timeout=2)
+            subprocess.Popen(['osascript', '-e', NOTIFICATION_SCRIPT, '--', title, message],
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
         except Exception as e:
             logger.debug(f"Не удалось показать уведомление: {e}")
     
+    def _get_display_bounds(self, displays: list) -> tuple:
+        """Кортежи (x1, y1, x2, y2) для displays, пересчет только если передан другой список"""
+        if displays is not self._bounds_displays:
+            self._display_bounds = tuple(
+                (d['x'], d['y'], d['x'] + d['width'], d['y'] + d['height']) for d in displays
+            )
+            self._bounds_displays = displays
+        return self._display_bounds
+    
     def get_cursor_monitor_index(self, displays: list) -> int:
         """
         Определяет, на каком мониторе находится курсор
@@ -120,26 +189,14 @@ class UserActivityDetector:
         Returns:
             Индекс монитора (0, 1, ...)
         """
-        try:
-            # Получаем позицию курсора через AppleScript
-            script = 'do shell script "echo $(osascript -e \\"tell application \\\\\\"System Events\\\\\\" to get position of mouse\\")"'
-            result = subprocess.run(['osascript', '-e', script], 
-                                  capture_output=True, text=True, timeout=1)
-            
-            if result.returncode == 0:
-                # Парсим координаты "x, y"
-                coords = result.stdout.strip().split(',')
-                if len(coords) == 2:
-                    x = int(coords[0].strip())
-                    y = int(coords[1].strip())
-                    
-                    # Определяем монитор
-                    for i, display in enumerate(displays):
-                        if (display['x'] <= x < display['x'] + display['width'] and
-                            display['y'] <= y < display['y'] + display['height']):
-                            return i
-        except Exception as e:
-            logger.debug(f"Не удалось определить позицию курсора: {e}")
+        cursor = _cursor_xy()
+        if cursor is None:
+            return 0
+        
+        # Определяем монитор
+        for i, bounds in enumerate(self._get_display_bounds(displays)):
+            if _contains(bounds, *cursor):
+                return i
         
         return 0  # По умолчанию первый монитор
     
@@ -154,5 +211,15 @@ class UserActivityDetector:
         Returns:
             True если курсор на втором мониторе
         """
-        current_index = self.get_cursor_monitor_index(displays)
-        return current_index == secondary_index
+        cursor = _cursor_xy()
+        if cursor is None:
+            return self.get_cursor_monitor_index(displays) == secondary_index
+        
+        # Результат тот же, что get_cursor_monitor_index(displays) == secondary_index,
+        # но обычно хватает проверки одного монитора
+        all_bounds = self._get_display_bounds(displays)
+        if secondary_index < len(all_bounds) and _contains(all_bounds[secondary_index], *cursor):
+            # Перекрытые/зеркальные мониторы: побеждает первый по списку, как в get_cursor_monitor_index
+            return not any(_contains(b, *cursor) for b in all_bounds[:secondary_index])
+        # Курсор не на нем - совпасть может только значение по умолчанию (0, курсор вне всех мониторов)
+        return secondary_index == 0 and not any(_contains(b, *cursor) for b in all_bounds)